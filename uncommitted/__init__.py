@@ -68,6 +68,130 @@ contribute additional detection and scanning routines.
 Changelog
 ---------
 
+**2.5** (unreleased)
+
+- Add ``-j`` / ``--jobs`` to check several repositories at once.  The
+  report is still printed in order, with submodules right after their
+  parent repository.
+
+- With git 2.35 or later, each git repository is now checked with two
+  git commands instead of four to six, using ``git status
+  --porcelain=v2`` and a single ``git for-each-ref``.
+
+- Git and Mercurial statuses are now cached in
+  ``$XDG_CACHE_HOME/uncommitted`` and reused for repositories whose
+  files and metadata have not changed since the previous run.
+  Directories that hold no tracked files, such as ignored build output,
+  are not looked at.  Use ``--no-cache`` to check every repository
+  regardless.
+
+- The filesystem walk now uses ``os.scandir()`` and no longer descends
+  into ``.git``, ``.hg``, or ``.svn`` directories.  Add ``--prune`` to
+  skip heavy directories like ``node_modules`` by name.
+
+- Add ``--walk-threads`` to list several directories at once while
+  walking, which speeds up discovery on NFS and other network mounts.
+
+- Add ``--stream`` to start checking repositories while the walk is
+  still finding more, printing each as soon as it has been checked.
+
+- Add ``--index PATH`` to remember the directory tree between runs, so
+  that later walks only re-read directories whose modification time has
+  changed; ``--reindex`` rebuilds the index from scratch.
+
+- Add ``--format json`` and ``--format ndjson`` to describe each
+  repository as a JSON object: its files and their status codes, the
+  branches that are ahead or behind, the stash, the non-tracking
+  branches, and how long the check took.
+
+- Add ``--timings`` to print how long discovery took, how many commands
+  were run, the time spent on each version control system, and the
+  slowest repositories.  ``--trace FILE`` also writes every command and
+  check as Chrome trace events.
+
+- Add ``python -m uncommitted.benchmark``, which builds a farm of
+  synthetic repositories and reports, as JSON, how long each discovery
+  strategy and each way of checking them takes, how many commands were
+  run, and how much memory was used.  ``--compare`` shows the speedup
+  or slowdown against the results of an earlier run.
+
+- Add ``--native``, which decides whether a git repository is clean by
+  reading its index, refs, and config, and by comparing the index with
+  the working tree's file details, without starting git at all.  Git
+  is still run for any repository that might not be clean.
+
+- Add ``--asyncio``, which checks repositories from a single thread
+  with asyncio subprocesses, running up to ``--jobs`` commands at once.
+
+- Add ``--hg-server``, which runs Mercurial commands through a
+  long-lived ``hg serve --cmdserver pipe`` process per thread, instead
+  of paying for Mercurial's startup in every repository.
+
+- Subversion working copies are now checked with one ``svn status
+  --xml`` at the root of each, instead of ``svn status -v``, whose list
+  of every unchanged file was thrown away.  The ``.svn`` directories
+  that pre-1.7 checkouts keep in each subdirectory are skipped without
+  running svn again.
+
+- ``-I`` now also accepts shell globs that start with ``glob:`` and
+  regular expressions that start with ``re:``.  All of the patterns are
+  compiled into a single regular expression, and the walk no longer
+  descends into the directories that they ignore.  Add ``--ignore-file``
+  to read a long list of patterns from a file.
+
+- Add ``--watch``, which checks every repository once and then keeps
+  running, using Linux inotify to check each repository again only
+  after it changes and has been quiet for ``--debounce`` seconds.  The
+  latest report is kept in a ``--state-file``, replaced all at once,
+  or sent to each client of a Unix ``--socket``.
+
+- Add ``--fsmonitor``, which turns on git's built-in fsmonitor daemon
+  and untracked cache for each ``git status``, where this version of
+  git supports them, so that large repositories are not scanned in
+  full.  ``--timings`` lists the repositories that took this fast path.
+
+- Add ``--any``, which only finds out whether any repository has
+  uncommitted work: each is checked with the cheapest commands that can
+  tell, like ``git diff-index --quiet HEAD``, while the walk goes on,
+  and everything stops at the first one found.  It prints that
+  repository and exits with status 1.  ``-q`` / ``--quiet`` is the same
+  but prints nothing.
+
+- Add ``--timeout`` and ``--repo-timeout`` to kill version control
+  commands that hang, along with any processes they started, when a
+  single command or a whole repository takes too long; the repository
+  is then reported as timed out.  Add ``--deadline`` to stop checking
+  after a while, listing the repositories that are left as not checked.
+
+- Add ``--batch-submodules``, which checks every submodule beneath a
+  git repository, nested ones included, with a single ``git submodule
+  foreach`` instead of separate git commands for each submodule.  The
+  submodules are reported just as before.
+
+- Add ``--walk-processes`` to search several of the paths given at once,
+  each in a worker process, for paths on different disks or mounts.
+  A path that is inside another path given is no longer searched a
+  second time.
+
+- ``-L`` remembers the directories it has visited in packed arrays of
+  inode numbers instead of a set of tuples, so following symlinks
+  through millions of directories takes a fraction of the memory.
+  Repositories are sorted before duplicates are dropped, instead of
+  also being kept in a set.
+
+- Importing ``uncommitted.command`` takes a few milliseconds instead of
+  about 25, because modules like ``subprocess``, ``threading``, and
+  ``optparse`` are now imported only by the code that needs them, and
+  regular expressions are compiled when first used.  A test keeps the
+  import under a time budget.
+
+- Add ``--prompt``, which prints how many repositories had uncommitted
+  work when last scanned with the same arguments, in a few milliseconds,
+  for shell prompts.  If that scan is older than ``--prompt-ttl``
+  seconds (default 60), a new one starts in the background, at most
+  once per TTL.  Any scan can also write that count to a file with
+  ``--summary-file``.  ``python -m uncommitted`` now works too.
+
 **2.4** (2020 January 10)
 
 - *Improvement:* show a more informative error message when a repository
@@ -0,0 +1,3 @@
+from uncommitted.command import main
+
+main()
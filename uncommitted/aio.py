@@ -0,0 +1,142 @@
+"""Check repositories from a single thread, using asyncio subprocesses.
+
+The status generators in `uncommitted.command` describe each command
+they need as a `Run` request instead of running it themselves.  Here
+those requests are carried out with ``asyncio.create_subprocess_exec``,
+so that a single thread can keep many version control processes busy at
+once.  A semaphore caps how many of them run at the same time.
+"""
+
+import asyncio
+import sys
+from subprocess import DEVNULL, PIPE, CalledProcessError
+from time import time
+
+from uncommitted import command
+from uncommitted.command import (
+    NEW_SESSION, ErrorCommandMissing, ErrorTimedOut, Probe, Run, Stream,
+    check_steps, kill_group,
+    )
+
+async def run(args, cwd, semaphore, probe=False, timeout=None, stream=False):
+    """Run a command, returning its lines of output, like `command.run()`.
+
+    At most as many commands as the `semaphore` allows are run at once.
+    If `probe` is true, the output is thrown away and the exit code is
+    returned instead, like `command.probe()`, and if `stream` is true,
+    it is returned as a single chunk, like `command.stream()`, though
+    only once the command has finished.  A command that is still running
+    after `timeout` seconds is killed, together with any processes that
+    it started, and `ErrorTimedOut` is raised.
+    """
+    fixed_cwd = cwd.decode() if (sys.platform == 'win32') else cwd
+    grouped = timeout is not None or command.processes is not None
+    session = NEW_SESSION if grouped else {}
+    async with semaphore:
+        start = time()
+        exit_code = None
+        try:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args, cwd=fixed_cwd, stdout=DEVNULL if probe else PIPE,
+                    stderr=DEVNULL if probe else None, **session)
+            except OSError:
+                raise ErrorCommandMissing(cwd, args[0])
+            try:
+                output, _ = await asyncio.wait_for(process.communicate(),
+                                                   timeout)
+            except asyncio.TimeoutError:
+                kill_group(process)
+                await process.wait()
+                raise ErrorTimedOut(cwd, args[0])
+            except asyncio.CancelledError:
+                if grouped:  # so that --any leaves nothing running
+                    kill_group(process)
+                else:
+                    process.kill()
+                raise
+            exit_code = process.returncode
+        finally:
+            if command.timings is not None:
+                command.timings.command(args, cwd, start, time() - start,
+                                        exit_code)
+    if probe:
+        return exit_code
+    if stream:
+        return chunks(output, exit_code, args)
+    if exit_code:
+        return ()
+    return output.splitlines()
+
+def chunks(output, exit_code, args):
+    """Generate `output` as the chunks of `command.stream()` would be."""
+    if output:
+        yield output
+    if exit_code:
+        raise CalledProcessError(exit_code, args)
+
+async def follow(steps, semaphore):
+    """Carry out the `Run` requests of a status generator, like `follow()`."""
+    request = next(steps)
+    while isinstance(request, Run):
+        try:
+            answer = await run(request.command, request.cwd, semaphore,
+                               isinstance(request, Probe), request.timeout,
+                               isinstance(request, Stream))
+        except (ErrorCommandMissing, ErrorTimedOut) as e:
+            request = steps.throw(e)
+        else:
+            request = steps.send(answer)
+    steps.close()
+    return request
+
+def check_with_asyncio(repos, ignore_set, options, cache=None):
+    """Check repositories using asyncio, yielding reports in order.
+
+    At most ``options.jobs`` commands run at once.  Only a few times that
+    many repositories are in progress at any moment, so that memory stays
+    small however many there are.  Subversion repositories are checked
+    one at a time, in order, for the same reason as in
+    `command.check_concurrently()`.
+    """
+    loop = asyncio.new_event_loop()
+    semaphore = loop.run_until_complete(make_semaphore(options.jobs))
+    window = 4 * options.jobs
+    pending = []
+    previous_svn = None
+    repos = iter(repos)
+    try:
+        while True:
+            while len(pending) < window:
+                repo = next(repos, None)
+                if repo is None:
+                    break
+                directory, dotdir = repo
+                steps = check_steps(directory, dotdir, ignore_set, options,
+                                    cache)
+                waiting = previous_svn if dotdir == b'.svn' else None
+                task = loop.create_task(after(waiting, steps, semaphore))
+                if dotdir == b'.svn':
+                    previous_svn = task
+                pending.append(task)
+            if not pending:
+                break
+            for report in loop.run_until_complete(pending.pop(0)):
+                yield report
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+async def make_semaphore(value):
+    """Create a semaphore that belongs to the running event loop."""
+    return asyncio.Semaphore(value)
+
+async def after(previous, steps, semaphore):
+    """Wait for the `previous` task, if any, then follow `steps`."""
+    if previous is not None:
+        await asyncio.wait([previous])
+    return await follow(steps, semaphore)
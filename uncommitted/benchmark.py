@@ -0,0 +1,427 @@
+"""Benchmark "uncommitted" against a synthetic farm of repositories.
+
+Run ``python -m uncommitted.benchmark --help`` for the options.  The
+farm is built beneath a temporary directory (or the one given with
+``--directory``), then each discovery strategy and each way of checking
+the repositories is timed.  The results are printed as JSON, so that a
+run against one version can be compared with ``--compare`` to a run
+against another.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+from functools import partial
+from optparse import OptionParser, Values
+from subprocess import STDOUT, CalledProcessError, check_call, check_output
+from time import sleep, time
+
+import uncommitted
+from uncommitted import cache, command
+from uncommitted.timings import Timings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+USAGE = '''usage: %prog [options]
+
+  Builds a farm of git, Mercurial, and Subversion repositories, then
+  times how long "uncommitted" takes to find and to check them.'''
+
+GIT_ENVIRONMENT = {
+    'GIT_AUTHOR_NAME': 'Benchmark', 'GIT_AUTHOR_EMAIL': 'bench@example.com',
+    'GIT_COMMITTER_NAME': 'Benchmark',
+    'GIT_COMMITTER_EMAIL': 'bench@example.com',
+    }
+
+class Farm(object):
+    """Builds repositories beneath `root`, reading settings from `options`."""
+
+    def __init__(self, root, options):
+        self.root = root
+        self.options = options
+        self.env = dict(os.environ, **GIT_ENVIRONMENT)
+        self.sources = os.path.join(root, 'sources')
+        self.trees = os.path.join(root, 'farm')
+        self.count = 0
+        self.repositories = 0
+
+    def build(self):
+        """Create every repository, returning the directory they are in."""
+        os.makedirs(self.sources)
+        os.makedirs(self.trees)
+        o = self.options
+        for i in range(o.git):
+            self.git(self.place(), submodule=i < o.submodules)
+        for i in range(o.hg):
+            self.hg(self.place())
+        for i in range(o.svn):
+            self.svn(self.place())
+        for i in range(o.plain):
+            path = self.place()
+            os.makedirs(path)
+            self.write(path, 'README', 'not a repository\n')
+        return self.trees
+
+    def place(self):
+        """Return a new directory path, nested `depth` levels deep."""
+        self.count += 1
+        n = self.count
+        parts = []
+        for level in range(self.options.depth):
+            parts.append('d%d' % (n % self.options.fanout))
+            n //= self.options.fanout
+        parts.append('r%d' % self.count)
+        return os.path.join(self.trees, *parts)
+
+    def dirty(self):
+        """Return whether the next repository should have changes."""
+        fraction = self.options.dirty_fraction
+        self.repositories += 1
+        return int(self.repositories * fraction) \
+            != int((self.repositories - 1) * fraction)
+
+    def run(self, cwd, *args):
+        check_call(args, cwd=cwd, env=self.env, stdout=open(os.devnull, 'w'),
+                   stderr=STDOUT)
+
+    def write(self, path, name, text):
+        with open(os.path.join(path, name), 'a') as f:
+            f.write(text)
+
+    def commit_files(self, path):
+        for i in range(self.options.files):
+            self.write(path, 'file%d.txt' % i, 'line %d\n' % i)
+
+    def dirty_files(self, path):
+        for i in range(min(self.options.dirty_files, self.options.files)):
+            self.write(path, 'file%d.txt' % i, 'changed\n')
+
+    def git(self, path, submodule=False):
+        os.makedirs(path)
+        self.run(path, 'git', 'init', '-q')
+        self.commit_files(path)
+        self.run(path, 'git', 'add', '.')
+        self.run(path, 'git', 'commit', '-q', '-m', 'Add files')
+        if submodule:
+            source = os.path.join(self.sources, 'sub%d' % self.count)
+            self.git(source)
+            self.run(path, 'git', '-c', 'protocol.file.allow=always',
+                     'submodule', '-q', 'add', source, 'sub')
+            self.run(path, 'git', 'commit', '-q', '-m', 'Add submodule')
+        head = check_output(['git', 'symbolic-ref', '--short', 'HEAD'],
+                            cwd=path).decode('ascii').strip()
+        for i in range(self.options.branches):
+            branch = 'branch%d' % i
+            self.run(path, 'git', 'checkout', '-q', '--track', '-b', branch,
+                     head)
+            if i % 2:
+                self.write(path, 'file0.txt', 'on %s\n' % branch)
+                self.run(path, 'git', 'commit', '-q', '-a', '-m', branch)
+            self.run(path, 'git', 'checkout', '-q', head)
+        for i in range(self.options.stashes):
+            self.write(path, 'file0.txt', 'stash %d\n' % i)
+            self.run(path, 'git', 'stash', '-q')
+        if self.dirty():
+            self.dirty_files(path)
+
+    def hg(self, path):
+        os.makedirs(path)
+        self.run(path, 'hg', 'init')
+        self.commit_files(path)
+        self.run(path, 'hg', 'commit', '-q', '-A', '-m', 'Add files',
+                 '--config', 'ui.username=Benchmark')
+        if self.dirty():
+            self.dirty_files(path)
+
+    def svn(self, path):
+        source = os.path.join(self.sources, 'svn%d' % self.count)
+        self.run(self.sources, 'svnadmin', 'create', source)
+        url = 'file://' + source.replace(os.sep, '/')
+        self.run(self.trees, 'svn', 'checkout', '-q', url, path)
+        self.commit_files(path)
+        self.run(path, 'svn', 'add', '-q', *[
+            'file%d.txt' % i for i in range(self.options.files)])
+        self.run(path, 'svn', 'commit', '-q', '-m', 'Add files')
+        if self.dirty():
+            self.dirty_files(path)
+
+def measure(name, function, repeat, setup=None):
+    """Time `function`, returning a result dictionary named `name`.
+
+    The function is called `repeat` times, running `setup` before each
+    call.  Its return value is reported as the number of repositories.
+    A final call is made with tracemalloc running, to measure the peak
+    memory it allocates without slowing down the timed calls.
+    """
+    runs = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        command.timings = Timings()
+        start = time()
+        repositories = function()
+        runs.append(time() - start)
+        events = command.timings.events
+        command.timings = None
+    commands = sum(1 for event in events if event[0] == 'command')
+    peak_memory = None
+    if tracemalloc is not None:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    runs.sort()
+    return {
+        'name': name,
+        'seconds': runs[0],
+        'median_seconds': runs[len(runs) // 2],
+        'runs': len(runs),
+        'repositories': repositories,
+        'commands': commands,
+        'peak_memory': peak_memory,
+        }
+
+def discover(path, find_repos):
+    return len(list(command.find_all_repositories([path], find_repos, set())))
+
+def discover_roots(path, find_repos, processes):
+    """Search each directory beneath `path` as a separate root."""
+    roots = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    roots = [root for root in roots if os.path.isdir(root)]
+    return len(list(command.find_all_repositories(roots, find_repos, set(),
+                                                  processes)))
+
+def check(repos, options):
+    command.scan(list(repos), options)
+    return len(repos)
+
+def check_with_hg_servers(repos, options):
+    from uncommitted.hgserver import CommandServers
+    command.hg_servers = CommandServers()
+    try:
+        return check(repos, options)
+    finally:
+        command.hg_servers.close()
+        command.hg_servers = None
+
+def status_options(**overrides):
+    """Build the options that `scan()` looks at, as main() would."""
+    options = Values({
+        'verbose': False, 'untracked': False, 'non_tracking': False,
+        'stash': False, 'ignore': None, 'ignore_svn_states': None,
+        'jobs': 1, 'use_cache': False, 'stream': False, 'format': 'text',
+        'native': False, 'asyncio': False, 'fsmonitor': False,
+        'any': False, 'quiet': False, 'timeout': None, 'repo_timeout': None,
+        'deadline': None, 'batch_submodules': False, 'summary_file': None,
+        })
+    options._update_loose(overrides)
+    return options
+
+def benchmark(path, repeat, workdir):
+    """Measure discovery and checking of the repositories beneath `path`."""
+    walk = command.find_repositories_by_walking_without_following_symlinks
+    follow = command.find_repositories_by_walking_and_following_symlinks
+    index_path = os.path.join(fsencode(workdir), b'index.pickle')
+    def index(reindex):
+        return partial(walk, index=cache.DirectoryIndex(index_path, reindex))
+    def save_index():
+        index = cache.DirectoryIndex(index_path, True)
+        discover(path, partial(walk, index=index))
+        index.save([path])
+
+    results = [
+        measure('discovery/walk', partial(discover, path, walk), repeat),
+        measure('discovery/walk-threads-8',
+                partial(discover, path, partial(walk, threads=8)), repeat),
+        measure('discovery/follow-symlinks',
+                partial(discover, path, follow), repeat),
+        measure('discovery/roots',
+                partial(discover_roots, path, walk, 1), repeat),
+        measure('discovery/roots-processes-4',
+                partial(discover_roots, path, walk, 4), repeat),
+        measure('discovery/index-cold',
+                lambda: discover(path, index(True)), repeat),
+        ]
+    save_index()
+    results.append(measure('discovery/index-warm',
+                           lambda: discover(path, index(False)), repeat))
+
+    repos = sorted(command.find_all_repositories([path], walk, set()))
+    cache_path = cache.default_path()
+    def clear_cache():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+    status = [
+        ('status/serial', status_options(), None),
+        ('status/jobs-8', status_options(jobs=8), None),
+        ('status/stream-jobs-8', status_options(jobs=8, stream=True), None),
+        ('status/asyncio-jobs-8', status_options(jobs=8, asyncio=True),
+         None),
+        ('status/all-flags', status_options(
+            untracked=True, non_tracking=True, stash=True), None),
+        ('status/native', status_options(native=True), None),
+        ('status/any-jobs-8', status_options(jobs=8, any=True, quiet=True),
+         None),
+        ('status/cache-cold', status_options(use_cache=True), clear_cache),
+        ('status/cache-warm', status_options(use_cache=True), None),
+        # Last, since the untracked cache that it adds to each git index
+        # changes the fingerprints that the status cache relies on.
+        ('status/fsmonitor', status_options(
+            untracked=True, non_tracking=True, stash=True, fsmonitor=True),
+         None),
+        ]
+    for name, options, setup in status:
+        results.append(measure(name, partial(check, repos, options),
+                               repeat, setup))
+    results.append(measure('status/hg-server', partial(
+        check_with_hg_servers, repos, status_options()), repeat))
+    return results
+
+def compare(old, new):
+    """Return lines of text comparing two benchmark reports."""
+    old_results = dict((r['name'], r) for r in old['results'])
+    lines = ['%-28s %10s %10s %8s' % ('benchmark', 'old', 'new', 'ratio')]
+    for result in new['results']:
+        previous = old_results.get(result['name'])
+        if previous is None:
+            continue
+        ratio = result['seconds'] / previous['seconds'] \
+            if previous['seconds'] else float('inf')
+        lines.append('%-28s %9.3fs %9.3fs %7.2fx' % (
+            result['name'], previous['seconds'], result['seconds'], ratio))
+    return lines
+
+def fsencode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+def version_of(program):
+    try:
+        return check_output([program, '--version'], stderr=STDOUT) \
+            .decode('utf-8', 'replace').splitlines()[0]
+    except (OSError, CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = OptionParser(usage=USAGE)
+    parser.add_option('--git', type='int', default=40, metavar='N',
+        help='number of git repositories (default: %default)')
+    parser.add_option('--hg', type='int', default=10, metavar='N',
+        help='number of Mercurial repositories (default: %default)')
+    parser.add_option('--svn', type='int', default=0, metavar='N',
+        help='number of Subversion checkouts (default: %default)')
+    parser.add_option('--plain', type='int', default=100, metavar='N',
+        help='number of directories that are not repositories'
+        ' (default: %default)')
+    parser.add_option('--depth', type='int', default=3, metavar='N',
+        help='how many directories deep to nest each repository'
+        ' (default: %default)')
+    parser.add_option('--fanout', type='int', default=4, metavar='N',
+        help='subdirectories at each level of nesting (default: %default)')
+    parser.add_option('--submodules', type='int', default=4, metavar='N',
+        help='how many git repositories have a submodule'
+        ' (default: %default)')
+    parser.add_option('--branches', type='int', default=2, metavar='N',
+        help='extra tracking branches in each git repository, every'
+        ' other one ahead of its upstream (default: %default)')
+    parser.add_option('--stashes', type='int', default=1, metavar='N',
+        help='stashes in each git repository (default: %default)')
+    parser.add_option('--files', type='int', default=5, metavar='N',
+        help='committed files in each repository (default: %default)')
+    parser.add_option('--dirty-files', type='int', default=2, metavar='N',
+        help='files changed in each dirty repository (default: %default)')
+    parser.add_option('--dirty-fraction', type='float', default=0.5,
+        metavar='F',
+        help='fraction of repositories that are dirty (default: %default)')
+    parser.add_option('--repeat', type='int', default=3, metavar='N',
+        help='time each benchmark N times and keep the fastest'
+        ' (default: %default)')
+    parser.add_option('--directory', metavar='PATH',
+        help='build the farm in PATH and keep it, or reuse the farm'
+        ' already there')
+    parser.add_option('-o', '--output', metavar='FILE',
+        help='write the JSON results to FILE instead of standard output')
+    parser.add_option('--compare', metavar='FILE',
+        help='compare the results against an earlier run saved in FILE')
+
+    (options, args) = parser.parse_args(argv)
+
+    if args or options.repeat < 1 or options.depth < 0 \
+            or options.fanout < 1:
+        parser.print_help()
+        exit(2)
+
+    workdir = tempfile.mkdtemp(prefix='uncommitted-benchmark-')
+    root = options.directory or os.path.join(workdir, 'root')
+    original_output = command.output
+    original_cache_home = os.environ.get('XDG_CACHE_HOME')
+    try:
+        os.environ['XDG_CACHE_HOME'] = workdir
+        farm = Farm(root, options)
+        command.output = lambda thing: None
+        path = fsencode(os.path.abspath(farm.trees))
+        if not os.path.isdir(farm.trees):
+            farm.build()
+            # Git only refreshes an index once its files are no longer
+            # racily clean, so let them age, check every repository so
+            # that git rewrites its index, then let the indexes age too
+            # so that the caches will trust them.
+            sleep(cache.RACY_SECONDS)
+            walk = command.find_repositories_by_walking_without_following_symlinks
+            check(sorted(command.find_all_repositories([path], walk, set())),
+                  status_options())
+            sleep(cache.RACY_SECONDS)
+        results = benchmark(path, options.repeat, workdir)
+    finally:
+        command.output = original_output
+        if original_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = original_cache_home
+        shutil.rmtree(workdir)
+
+    report = {
+        'uncommitted': uncommitted.__version__,
+        'python': sys.version.split()[0],
+        'git': version_of('git'),
+        'hg': version_of('hg'),
+        'svn': version_of('svn'),
+        'farm': dict((name, getattr(options, name)) for name in (
+            'git', 'hg', 'svn', 'plain', 'depth', 'fanout', 'submodules',
+            'branches', 'stashes', 'files', 'dirty_files',
+            'dirty_fraction')),
+        'results': results,
+        }
+    if resource is not None:
+        usage = resource.getrusage
+        report['max_rss'] = usage(resource.RUSAGE_SELF).ru_maxrss
+        report['max_rss_children'] = usage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    text = json.dumps(report, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+    if options.compare:
+        with open(options.compare) as f:
+            old = json.load(f)
+        sys.stderr.write('\n'.join(compare(old, report)) + '\n')
+
+if __name__ == '__main__':
+    main()
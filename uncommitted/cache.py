@@ -0,0 +1,328 @@
+"""Caches that are kept between runs.
+
+A `ScanCache` remembers the status lines and subrepos that each
+repository reported, together with a fingerprint of the stat() details
+of its version control metadata and of every file and directory in its
+working tree.  While the fingerprint stays the same, the repository
+cannot have changed, so its version control tool need not be run again.
+A working tree is not walked into directories that cannot change the
+report: those without tracked files, unless untracked git files are
+being reported, and then those without tracked files that git ignores.
+
+A `DirectoryIndex` remembers the subdirectories of every directory that
+a walk has listed, so that a later walk only needs to list directories
+whose modification time has changed since.
+"""
+
+import hashlib
+import os
+import pickle
+import struct
+import time
+
+from uncommitted.command import cache_directory, make_directories
+
+MAX_ENTRIES = 20000
+RACY_SECONDS = 2.0
+
+# Bumped whenever what is pickled changes meaning, so that the files
+# written by an older release are thrown away rather than trusted.
+FORMAT = 2
+
+DIRSTATE_ENTRY = struct.Struct('>cllll')
+
+# The files and directories beneath each kind of dot-directory whose
+# modification, in addition to the working tree's, can change a report.
+METADATA = {
+    b'.git': (b'HEAD', b'index', b'config', b'packed-refs', b'refs',
+              b'logs/refs/stash', b'info/exclude'),
+    b'.hg': (b'dirstate',),
+    }
+
+def default_path():
+    """Return the path to the cache file, following the XDG convention."""
+    return os.path.join(cache_directory(), b'scan.pickle')
+
+class ScanCache(object):
+    """Status results for repositories whose fingerprint is unchanged."""
+
+    def __init__(self, path):
+        self.path = path
+        self.now = time.time()
+        self.entries = load(path)
+
+    def key(self, directory, dotdir, options):
+        return (directory, dotdir, bool(options.untracked),
+                bool(options.non_tracking), bool(options.stash))
+
+    def fingerprint(self, directory, dotdir, options):
+        """Return a digest of the repository's stat() details.
+
+        Returns None if the repository cannot be cached: either because
+        it is not a kind we know how to fingerprint, or because a file
+        was modified so recently that a further change might not yet
+        show up in its modification time.
+        """
+        if dotdir not in METADATA:
+            return None
+        if os.path.exists(os.path.join(directory, b'.gitmodules')):
+            return None  # submodule commits live outside the worktree
+        vcsdirs = [git_directory(os.path.join(directory, dotdir))]
+        commondir = os.path.join(vcsdirs[0], b'commondir')
+        if os.path.isfile(commondir):  # a worktree shares the main refs
+            with open(commondir, 'rb') as f:
+                vcsdirs.append(os.path.join(vcsdirs[0], f.read().strip()))
+        stats = []
+        for vcsdir in vcsdirs:
+            for name in METADATA[dotdir]:
+                stats.extend(tree_stats(os.path.join(vcsdir, name), ()))
+        if dotdir == b'.git':
+            unchanging = git_unchanging(directory, vcsdirs[0], vcsdirs[-1],
+                                        options.untracked)
+        else:
+            unchanging = hg_unchanging(directory, vcsdirs[0])
+        stats.extend(tree_stats(directory, METADATA, unchanging))
+        if any(self.now - mtime < RACY_SECONDS for p, mtime, size in stats):
+            return None
+        return hashlib.sha1(repr(stats).encode('ascii')).digest()
+
+    def lookup(self, key, fingerprint):
+        """Return the cached (lines, subrepos) for `key`, or None."""
+        entry = self.entries.get(key)
+        if fingerprint is None or entry is None or entry[0] != fingerprint:
+            return None
+        self.entries[key] = entry[:3] + (self.now,)
+        return entry[1], entry[2]
+
+    def store(self, key, fingerprint, lines, subrepos):
+        """Remember the status of a repository."""
+        if fingerprint is not None and lines is not None:
+            self.entries[key] = (fingerprint, lines, subrepos, self.now)
+
+    def save(self):
+        """Write the cache, evicting entries for vanished repositories.
+
+        If there are still more than `MAX_ENTRIES` entries afterwards,
+        those that have gone unused for longest are dropped as well.
+        """
+        entries = dict((key, entry) for key, entry in self.entries.items()
+                       if os.path.exists(os.path.join(key[0], key[1])))
+        if len(entries) > MAX_ENTRIES:
+            keys = sorted(entries, key=lambda key: entries[key][3])
+            for key in keys[:len(entries) - MAX_ENTRIES]:
+                del entries[key]
+        dump(entries, self.path)
+
+class DirectoryIndex(object):
+    """The subdirectories of each directory, as of its last listing."""
+
+    def __init__(self, path, reindex=False):
+        self.path = path
+        self.now = time.time()
+        self.visited = set()
+        self.entries = {} if reindex else load(path)
+
+    def lookup(self, dirpath, mtime):
+        """Return the (name, is_symlink) list for `dirpath`, or None.
+
+        The list is only returned if the directory's modification time
+        still matches the one it had when it was listed.
+        """
+        self.visited.add(dirpath)
+        entry = self.entries.get(dirpath)
+        if entry is None or entry[0] != mtime:
+            return None
+        return entry[1]
+
+    def store(self, dirpath, mtime, subdirectories):
+        """Remember a (name, is_symlink) list for `dirpath`."""
+        if self.now - mtime >= RACY_SECONDS:
+            self.entries[dirpath] = (mtime, subdirectories)
+
+    def save(self, roots):
+        """Write the index to disk.
+
+        Directories beneath the `roots` that were walked this time, but
+        that the walk never reached, have been deleted or moved away, so
+        their entries are dropped.
+        """
+        prefixes = tuple(os.path.join(root, b'') for root in roots)
+        entries = dict((dirpath, entry)
+                       for dirpath, entry in self.entries.items()
+                       if dirpath in self.visited
+                       or not (dirpath in roots
+                               or dirpath.startswith(prefixes)))
+        dump(entries, self.path)
+
+def load(path):
+    """Load a pickle, returning an empty dict if it is missing or broken.
+
+    A pickle written in another `FORMAT` counts as broken.
+    """
+    try:
+        with open(path, 'rb') as f:
+            version, entries = pickle.load(f)
+    except Exception:
+        return {}
+    return entries if version == FORMAT else {}
+
+def dump(entries, path):
+    """Atomically replace the pickle at `path` with `entries`."""
+    directory = os.path.dirname(path)
+    if directory:
+        make_directories(directory)
+    tmp_path = b'%s.%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((FORMAT, entries), f, 2)
+    getattr(os, 'replace', os.rename)(tmp_path, path)
+
+def git_directory(path):
+    """Follow the ``gitdir:`` pointer in a submodule's ``.git`` file."""
+    if not os.path.isfile(path):
+        return path
+    with open(path, 'rb') as f:
+        pointer = f.read().strip()
+    if not pointer.startswith(b'gitdir: '):
+        return path
+    return os.path.join(os.path.dirname(path), pointer[8:])
+
+def git_unchanging(directory, gitdir, commondir, untracked):
+    """Return a test for directories that cannot change git's report.
+
+    A directory holding no tracked files can only change the report by
+    holding untracked ones, so it cannot change it at all unless
+    `untracked` files are reported, and even then not if git ignores
+    it.  Only a root ``.gitignore`` or ``info/exclude`` pattern that is
+    a plain name is understood, and none of them are trusted while a
+    ``!`` pattern might bring the directory back.  Returns None if
+    every directory has to be walked.
+    """
+    from uncommitted.native import tracked_paths
+    tracked = tracked_paths(os.path.join(gitdir, b'index'))
+    if tracked is None:
+        return None
+    if not untracked:
+        return untracked_test(directory, tracked)
+    ignored = ignored_names([os.path.join(directory, b'.gitignore'),
+                             os.path.join(commondir, b'info', b'exclude')])
+    if not ignored:
+        return None
+    negating = {directory: False}
+
+    def negated(dirpath):
+        """Whether a ``.gitignore`` from `dirpath` up has a ``!``."""
+        if dirpath not in negating:
+            negating[dirpath] = (
+                ignored_names([os.path.join(dirpath, b'.gitignore')])
+                is None or negated(os.path.dirname(dirpath)))
+        return negating[dirpath]
+    return untracked_test(directory, tracked, ignored, negated)
+
+def hg_unchanging(directory, hgdir):
+    """Return a test for directories that cannot change Mercurial's report.
+
+    Untracked files are never reported for Mercurial, so a directory
+    holding no tracked files cannot change the report.  Returns None if
+    every directory has to be walked.
+    """
+    tracked = dirstate_paths(hgdir)
+    if tracked is None:
+        return None
+    return untracked_test(directory, tracked)
+
+def untracked_test(directory, tracked, ignored=None, negated=None):
+    """Return a test for directories beneath `directory` to leave out.
+
+    A directory is left out if it is none of the `tracked` paths, nor
+    above any of them, and if its name is one of the `ignored` names,
+    unless those are None.  A `negated` test can veto an ignored name
+    for the directories beneath the path that it is given.
+    """
+    prefix = len(os.path.join(directory, b''))
+    sep = os.sep.encode('ascii')
+
+    def unchanging(path):
+        if path[prefix:].replace(sep, b'/') in tracked:
+            return False
+        if ignored is None:
+            return True
+        return os.path.basename(path) in ignored and not (
+            negated and negated(os.path.dirname(path)))
+    return unchanging
+
+def ignored_names(paths):
+    """Return the plain names that the ignore files at `paths` list.
+
+    Returns None if any of them has a ``!`` pattern.
+    """
+    names = set()
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines()
+        except EnvironmentError:
+            continue
+        for line in lines:
+            line = line.rstrip(b' ')
+            if line.startswith(b'!'):
+                return None
+            if line.endswith(b'/'):
+                line = line[:-1]
+            if line and not any(c in line for c in b'#/*?[\\'):
+                names.add(line)
+    return names
+
+def dirstate_paths(hgdir):
+    """Return the set of files in the dirstate and the directories above.
+
+    Returns None if the dirstate cannot be read, or is not in the first
+    format, which lists every path in full.
+    """
+    try:
+        with open(os.path.join(hgdir, b'requires'), 'rb') as f:
+            if b'dirstate-v2' in f.read().split():
+                return None
+    except EnvironmentError:
+        pass
+    paths = set()
+    try:
+        with open(os.path.join(hgdir, b'dirstate'), 'rb') as f:
+            data = f.read()
+        offset = 40  # past the two parent changesets
+        while offset < len(data):
+            state, mode, size, mtime, length = DIRSTATE_ENTRY.unpack_from(
+                data, offset)
+            offset += DIRSTATE_ENTRY.size + length
+            if offset > len(data):
+                return None
+            # A copied file's name is followed by a NUL and its source.
+            name = data[offset - length:offset].split(b'\0')[0]
+            while name and name not in paths:
+                paths.add(name)
+                name = name.rpartition(b'/')[0]
+    except (EnvironmentError, struct.error):
+        return None
+    return paths
+
+def tree_stats(path, skip, unchanging=None):
+    """Return (path, mtime, size) for `path` and everything beneath it.
+
+    Directories named in `skip` are left out, along with their contents,
+    and so are directories for which `unchanging` returns true.
+    """
+    stats = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [d for d in dirnames if d not in skip and not (
+            unchanging and unchanging(os.path.join(dirpath, d)))]
+        for name in dirnames + filenames:
+            stats.append(stat(os.path.join(dirpath, name)))
+    stats.append(stat(path))
+    return stats
+
+def stat(path):
+    """Return (path, mtime, size) for `path`, or zeros if it is missing."""
+    try:
+        s = os.lstat(path)
+    except OSError:
+        return path, 0, 0
+    return path, s.st_mtime, s.st_size
@@ -1,10 +1,21 @@
 """The 'uncommitted' command-line tool itself."""
 
 import os
-import re
 import sys
-from optparse import OptionParser
-from subprocess import CalledProcessError, check_output
+from collections import namedtuple
+from time import time
+
+from uncommitted.pathtrie import PathTrie
+
+try:
+    from os import scandir
+except ImportError:  # Python 2
+    scandir = None
+
+# Commands like ``uncommitted --any`` can be run very often, from hooks
+# and shell prompts, so modules that only some code paths need, like
+# subprocess, threading, and optparse, are imported by the functions
+# that use them instead of up here.
 
 USAGE = '''usage: %prog [options] path [path...]
 
@@ -19,34 +30,303 @@ class ErrorCommandMissing(Exception):
 class ErrorCannotLocate(Exception):
     """Signal that we cannot successfully run the locate(1) binary."""
 
-globchar = re.compile(br'([][*?])')
-git_submodule = re.compile(br'^[-+U ]*\S+ (.*) \([^)]*\)$')
+class ErrorTimedOut(Exception):
+    """Signal that a version control binary ran out of time and was killed."""
+
+class ErrorNotChecked(Exception):
+    """Signal that the deadline passed before a repository was checked."""
+
+class ErrorBadOutput(Exception):
+    """Signal that a version control binary printed output we cannot parse."""
+
+class LazyRegex(object):
+    """A regular expression that is not compiled until it is first used."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __getattr__(self, name):
+        import re
+        value = getattr(re.compile(self.pattern), name)
+        setattr(self, name, value)
+        return value
+
+globchar = LazyRegex(br'([][*?])')
+git_submodule = LazyRegex(br'^[-+U ]*\S+ (.*) \([^)]*\)$')
+git_ahead_behind = LazyRegex(br' \[ahead (\d+)(?:, behind (\d+))?\] ')
+git_escape = LazyRegex(br'\\([0-7]{3}|.)')
+git_path = LazyRegex(br'"(?:[^"\\]|\\.)*"|[^ ]+')
 linesep = os.linesep.encode('ascii')
+sep = os.sep.encode('ascii')
 
 def output(thing):
     """Replacement for print() that outputs bytes."""
     os.write(1, thing + linesep)
 
-def run(command, cwd):
-    """Run `command`, catch any exception, and return lines of output."""
+def cache_directory():
+    """Return the directory for files kept between runs, following XDG."""
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'uncommitted')
+    if not isinstance(path, bytes):
+        path = path.encode(sys.getfilesystemencoding())
+    return path
+
+def make_directories(path):
+    """Create the directory `path`, and those above it, if it is missing.
+
+    Another process might be creating it at the same moment, which is
+    fine as long as it then exists.
+    """
+    import errno
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+def write_atomically(path, data):
+    """Replace the file at `path` with `data`, all at once.
+
+    The temporary file is named after this process, so that processes
+    replacing the same file at the same time do not write into each
+    other's, and it is removed again if the replacement fails.
+    """
+    temporary = b'%s.%d' % (path, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        getattr(os, 'replace', os.rename)(temporary, path)
+    except EnvironmentError:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+
+def save(store, what, *args):
+    """Call `store.save(*args)`, only warning if `what` cannot be written.
+
+    The scan cache and the directory index just make the next run faster,
+    so failing to write one is no reason for this run to fail.
+    """
+    try:
+        store.save(*args)
+    except EnvironmentError as e:
+        sys.stderr.write('Warning: cannot write the %s: %s\n'
+                         % (what, e.strerror))
+
+def run(command, cwd, timeout=None):
+    """Run `command`, catch any exception, and return lines of output.
+
+    If the command is still running after `timeout` seconds, it is
+    killed and `ErrorTimedOut` is raised.
+    """
+    from subprocess import PIPE, CalledProcessError, check_output
     # Windows low-level subprocess API wants str for current working
     # directory.
     fixed_cwd = cwd.decode() if (sys.platform == 'win32') else cwd
+    start = time()
+    exit_code = 0
     try:
+        if hg_servers is not None and command[0] == 'hg':
+            result = hg_servers.run(command[1:], cwd, timeout)
+            if result is not None:
+                exit_code, output = result
+                if exit_code is None:
+                    raise ErrorTimedOut(cwd, command[0])
+                return () if exit_code else output.splitlines()
+        if timeout is not None or processes is not None:
+            exit_code, output = spawn(command, fixed_cwd, timeout, PIPE)
+            return () if exit_code else output.splitlines()
         # In Python 3, iterating over bytes yield integers, so we call
         # `splitlines()` to force Python 3 to give us lines instead.
         return check_output(command, cwd=fixed_cwd).splitlines()
-    except CalledProcessError:
+    except CalledProcessError as e:
+        exit_code = e.returncode
         return ()
+    except OSError:
+        exit_code = None
+        raise ErrorCommandMissing(cwd, command[0])
+    except ErrorTimedOut:
+        exit_code = None
+        raise ErrorTimedOut(cwd, command[0])
+    finally:
+        if timings is not None:
+            timings.command(command, cwd, start, time() - start, exit_code)
+
+def probe(command, cwd, timeout=None):
+    """Run `command`, discarding its output, and return its exit code.
+
+    A `timeout` is handled as by `run()`.
+    """
+    from subprocess import call
+    fixed_cwd = cwd.decode() if (sys.platform == 'win32') else cwd
+    start = time()
+    exit_code = None
+    try:
+        with open(os.devnull, 'wb') as devnull:
+            if timeout is not None or processes is not None:
+                exit_code, output = spawn(command, fixed_cwd, timeout,
+                                          devnull, devnull)
+            else:
+                exit_code = call(command, cwd=fixed_cwd, stdout=devnull,
+                                 stderr=devnull)
+        return exit_code
     except OSError:
         raise ErrorCommandMissing(cwd, command[0])
+    except ErrorTimedOut:
+        raise ErrorTimedOut(cwd, command[0])
+    finally:
+        if timings is not None:
+            timings.command(command, cwd, start, time() - start, exit_code)
+
+def stream(command, cwd, timeout=None):
+    """Run `command`, generating its output in chunks as it arrives.
+
+    Errors are raised as by `run()`, but only once the chunks are being
+    read.  After the last chunk, `CalledProcessError` is raised if the
+    command failed.  If the chunks are not all read, the command is
+    killed when the generator is closed.
+    """
+    from subprocess import PIPE, CalledProcessError, Popen
+    from threading import Timer
+    fixed_cwd = cwd.decode() if (sys.platform == 'win32') else cwd
+    start = time()
+    exit_code = None
+    try:
+        try:
+            process = Popen(command, cwd=fixed_cwd, stdout=PIPE,
+                            **NEW_SESSION)
+        except OSError:
+            raise ErrorCommandMissing(cwd, command[0])
+        killed = []
+        def kill():
+            killed.append(True)
+            kill_group(process)
+        timer = None
+        if timeout is not None:
+            timer = Timer(timeout, kill)
+            timer.start()
+        tracked = processes
+        if tracked is not None:
+            tracked.add(process)
+        try:
+            while True:
+                chunk = process.stdout.read(65536)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            if process.poll() is None:
+                kill_group(process)  # the reader stopped early
+            process.stdout.close()
+            exit_code = process.wait()
+            if timer is not None:
+                timer.cancel()
+            if tracked is not None:
+                tracked.discard(process)
+        if killed:
+            exit_code = None
+            raise ErrorTimedOut(cwd, command[0])
+        if exit_code:
+            raise CalledProcessError(exit_code, command)
+    finally:
+        if timings is not None:
+            timings.command(command, cwd, start, time() - start, exit_code)
+
+# Starting a command in a session of its own makes it the leader of a
+# new process group, which can then be killed all at once.
+if sys.platform == 'win32':
+    NEW_SESSION = {}
+elif sys.version_info[0] >= 3:
+    NEW_SESSION = {'start_new_session': True}
+else:  # Python 2
+    NEW_SESSION = {'preexec_fn': os.setsid}
+
+def spawn(command, cwd, timeout, stdout, stderr=None):
+    """Run `command` for at most `timeout` seconds, or None for no limit.
+
+    Returns its exit code and output.  If it runs out of time, it is
+    killed, together with any processes that it has started, and
+    `ErrorTimedOut` is raised.  While there are `processes` to track,
+    the command is added to them, so that it can be killed early.
+    """
+    from subprocess import Popen
+    from threading import Timer
+    tracked = processes
+    process = Popen(command, cwd=cwd, stdout=stdout, stderr=stderr,
+                    **NEW_SESSION)
+    killed = []
+    def kill():
+        killed.append(True)
+        kill_group(process)
+    timer = None
+    if timeout is not None:
+        timer = Timer(timeout, kill)
+        timer.start()
+    if tracked is not None:
+        tracked.add(process)
+    try:
+        output, _ = process.communicate()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if tracked is not None:
+            tracked.discard(process)
+    if killed:
+        raise ErrorTimedOut()
+    return process.returncode, output
+
+class Processes(object):
+    """The commands still running, so that they can all be killed at once.
+
+    Once `kill()` has been called, any command added is killed at once.
+    """
+
+    def __init__(self):
+        from threading import Lock
+        self.lock = Lock()
+        self.running = set()
+        self.killed = False
+
+    def add(self, process):
+        with self.lock:
+            self.running.add(process)
+            killed = self.killed
+        if killed:
+            kill_group(process)
+
+    def discard(self, process):
+        with self.lock:
+            self.running.discard(process)
+
+    def kill(self):
+        with self.lock:
+            self.killed = True
+            running = list(self.running)
+        for process in running:
+            kill_group(process)
+
+def kill_group(process):
+    """Kill a process started by `spawn()`, and every process it started."""
+    try:
+        if hasattr(os, 'killpg'):
+            from signal import SIGKILL
+            os.killpg(process.pid, SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        pass  # it has already exited
 
 def escape(s):
     """Escape the characters special to locate(1) globbing."""
     return globchar.sub(br'\\\1', s)
 
-def find_repositories_with_locate(path):
+def find_repositories_with_locate(path, prune=frozenset()):
     """Use locate to return a sequence of (directory, dotdir) pairs."""
+    from subprocess import CalledProcessError, check_output
     command = [b'locate', b'-0']
     for dotdir in DOTDIRS:
         # Escaping the slash (using '\/' rather than '/') is an
@@ -60,36 +340,226 @@ def find_repositories_with_locate(path):
     except CalledProcessError:
         return []
     return [os.path.split(p) for p in paths
-            if not os.path.islink(p) and os.path.isdir(p)]
+            if not os.path.islink(p) and os.path.isdir(p)
+            and not prune.intersection(p[len(path):].split(sep)[:-1])]
+
+def find_repositories_by_walking_without_following_symlinks(path,
+                                                            prune=(),
+                                                            threads=1,
+                                                            index=None,
+                                                            ignore=None):
+    """Walk a tree and generate (directory, dotdir) pairs."""
+    return walk(path, False, prune, threads, index, ignore)
 
-def find_repositories_by_walking_without_following_symlinks(path):
-    """Walk a tree and return a sequence of (directory, dotdir) pairs."""
-    repos = []
-    for dirpath, dirnames, filenames in os.walk(path, followlinks=False):
-        for dotdir in set(dirnames) & DOTDIRS:
-            repos.append((dirpath, dotdir))
-    return repos
+def find_repositories_by_walking_and_following_symlinks(path, prune=(),
+                                                        threads=1,
+                                                        index=None,
+                                                        ignore=None):
+    """Walk a tree and generate (directory, dotdir) pairs."""
+    return walk(path, True, prune, threads, index, ignore)
 
-def find_repositories_by_walking_and_following_symlinks(path):
-    """Walk a tree and return a sequence of (directory, dotdir) pairs."""
-    repos = []
+def walk(path, follow_symlinks, prune, threads=1, index=None, ignore=None):
+    """Walk a tree and generate (directory, dotdir) pairs.
+
+    The walk never descends into a version control dot-directory, since
+    no repository lives inside one, nor into any directory whose name
+    is in the `prune` set.  A directory whose path matches the `ignore`
+    regular expression is only looked at to see whether it is itself a
+    repository, since everything beneath it is ignored too.  If
+    `threads` is more than 1, that many directories are listed at once,
+    which helps on network filesystems where every directory listing is
+    a round trip to the server.  Given a `DirectoryIndex`, the walk only
+    lists directories whose modification time has changed since the
+    index last saw them.
+    """
+    from threading import Lock
+    lock = Lock()
 
     # This is for detecting symlink loops and escaping them. This is similar to
     # http://stackoverflow.com/questions/36977259/avoiding-infinite-recursion-with-os-walk/36977656#36977656
     def inode(path):
         stats = os.stat(path)
         return stats.st_dev, stats.st_ino
-    seen_inodes = {inode(path)}
+    if follow_symlinks:
+        from uncommitted.inodeset import InodeSet
+        seen_inodes = InodeSet()
+        seen_inodes.add(inode(path))
+
+    def visit(dirpath):
+        """Return the repositories and the subdirectories in `dirpath`."""
+        try:
+            if index is None:
+                subdirectories = list(list_subdirectories(dirpath))
+            else:
+                subdirectories = list_subdirectories_with_index(dirpath,
+                                                                index)
+        except OSError:
+            return [], []  # like os.walk(), skip directories we cannot read
+
+        if follow_symlinks:
+            inodes = [inode(p) for name, p, is_symlink in subdirectories]
+            with lock:
+                subdirectories = [d for d, i in zip(subdirectories, inodes)
+                                  if not i in seen_inodes]
+                seen_inodes.update(inodes)
+
+        repos = []
+        children = []
+        for name, p, is_symlink in subdirectories:
+            if name in DOTDIRS:
+                repos.append((dirpath, name))
+            elif name in prune or not (follow_symlinks or not is_symlink):
+                continue
+            elif ignore is not None and ignore.search(p):
+                try:
+                    repos.extend((p, n) for n, q, l in list_subdirectories(p)
+                                 if n in DOTDIRS)
+                except OSError:
+                    pass
+            else:
+                children.append(p)
+        return repos, children
+
+    if threads > 1:
+        for repo in visit_concurrently(path, visit, threads):
+            yield repo
+        return
+    stack = [path]
+    while stack:
+        repos, children = visit(stack.pop())
+        for repo in repos:
+            yield repo
+        stack.extend(reversed(children))
+
+def visit_concurrently(path, visit, threads):
+    """Call `visit()` on `path`, and on every path it returns, in threads.
+
+    Generates the repositories that `visit()` finds, as it finds them.
+    """
+    from threading import Lock, Thread
+    try:
+        from queue import Queue
+    except ImportError:  # Python 2
+        from Queue import Queue
+    queue = Queue()
+    results = Queue()
+    pending = [1]
+    stopping = []
+
+    def worker():
+        while True:
+            dirpath = queue.get()
+            if dirpath is None:
+                return
+            repos, children = [], []
+            if not stopping:
+                try:
+                    repos, children = visit(dirpath)
+                except Exception as e:
+                    results.put(e)
+            for repo in repos:
+                results.put(repo)
+            with lock:
+                pending[0] += len(children) - 1
+                done = not pending[0]
+            for child in children:
+                queue.put(child)
+            if done:
+                results.put(None)
+
+    lock = Lock()
+    workers = [Thread(target=worker) for i in range(threads)]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    queue.put(path)
+    try:
+        while True:
+            result = results.get()
+            if result is None:
+                break
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        stopping.append(True)
+        for thread in workers:
+            queue.put(None)
+
+def list_subdirectories_with_index(path, index):
+    """Like `list_subdirectories()`, but consulting a `DirectoryIndex`."""
+    mtime = os.stat(path).st_mtime
+    names = index.lookup(path, mtime)
+    if names is None:
+        subdirectories = list(list_subdirectories(path))
+        index.store(path, mtime, [(name, is_symlink) for name, p, is_symlink
+                                  in subdirectories])
+        return subdirectories
+    return [(name, os.path.join(path, name), is_symlink)
+            for name, is_symlink in names]
+
+def list_subdirectories(path):
+    """Generate (name, path, is_symlink) for each directory inside `path`.
+
+    Symbolic links that point at directories are included, too.
+    """
+    if scandir is None:  # Python 2
+        for name in os.listdir(path):
+            p = os.path.join(path, name)
+            if os.path.isdir(p):
+                yield name, p, os.path.islink(p)
+        return
+    for entry in scandir(path):
+        try:
+            if entry.is_dir():
+                yield entry.name, entry.path, entry.is_symlink()
+        except OSError:
+            pass
 
-    for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
-        inodes = [inode(os.path.join(dirpath, p)) for p in dirnames]
-        dirnames[:] = [p for p, i in zip(dirnames, inodes)
-                       if not i in seen_inodes]
-        seen_inodes.update(inodes)
+# A status generator yields a `Run` for each command whose output it
+# needs, is sent the command's lines of output in return, and finally
+# yields its result.  This lets the same code be driven both by `run()`
+# here and by the asyncio engine in `uncommitted.aio`.
+# A `timeout` in seconds can be added by the code following the
+# generator, which the generators themselves leave as None.
+Run = namedtuple('Run', 'command cwd timeout')
+Run.__new__.__defaults__ = (None,)
 
-        for dotdir in set(dirnames) & DOTDIRS:
-            repos.append((dirpath, dotdir))
-    return repos
+class Probe(Run):
+    """A `Run` whose generator is sent the exit code instead of the output."""
+    __slots__ = ()
+
+class Stream(Run):
+    """A `Run` whose generator is sent the output in chunks, like `stream()`.
+
+    Unlike lines, the chunks can be read while the command is running, so
+    large output need not all be held in memory at once.
+    """
+    __slots__ = ()
+
+def follow(steps):
+    """Run the commands that a status generator asks for, one at a time.
+
+    Returns the generator's result.  An `ErrorCommandMissing` or an
+    `ErrorTimedOut` raised by `run()` is thrown back into the generator,
+    so that it can decide whether to handle it.
+    """
+    request = next(steps)
+    while isinstance(request, Run):
+        if isinstance(request, Probe):
+            function = probe
+        elif isinstance(request, Stream):
+            function = stream
+        else:
+            function = run
+        try:
+            answer = function(request.command, request.cwd, request.timeout)
+        except (ErrorCommandMissing, ErrorTimedOut) as e:
+            request = steps.throw(e)
+        else:
+            request = steps.send(answer)
+    steps.close()
+    return request
 
 def status_mercurial(path, ignore_set, options):
     """Run hg status.
@@ -98,9 +568,49 @@ def status_mercurial(path, ignore_set, options):
     * Text lines describing the status of the repository.
     * Empty sequence of subrepos, since hg does not support them.
     """
-    lines = run(['hg', '--config', 'extensions.color=!', 'st'], cwd=path)
+    return follow(mercurial_steps(path, ignore_set, options))
+
+def mercurial_steps(path, ignore_set, options):
+    """Status generator behind `status_mercurial()`."""
+    lines = yield Run(['hg', '--config', 'extensions.color=!', 'st'], path)
     subrepos = ()
-    return [b' ' + l for l in lines if not l.startswith(b'?')], subrepos
+    yield [b' ' + l for l in lines if not l.startswith(b'?')], subrepos
+
+def mercurial_probe_steps(path, ignore_set, options):
+    """Status generator for --any, which only lists changes to tracked files.
+
+    Mercurial cannot be told to stop at the first change, but it can at
+    least be spared from listing unknown files.
+    """
+    lines = yield Run(['hg', '--config', 'extensions.color=!', 'st', '-mard'],
+                      path)
+    yield [b' ' + l for l in lines], ()
+
+def parse_git_version(lines):
+    """Return the version in ``git --version`` output as integers.
+
+    An empty tuple means that git did not tell us its version.
+    """
+    words = b''.join(lines).split()
+    version = words[2].split(b'.') if len(words) > 2 else ()
+    return tuple(int(n) for n in version if n.isdigit())
+
+# The version of git, which only gets asked once per run.
+_git_version = None
+
+# The (name, setting) pairs for the features that --fsmonitor can turn
+# on in `git status`, which are also only worked out once per run.
+_git_fast_path = None
+
+# The `Timings` recorder, when the user has asked for --timings.
+timings = None
+
+# The Mercurial `CommandServers`, when the user has asked for them.
+hg_servers = None
+
+# The `Processes` running commands for --any, which are killed as soon
+# as the answer is known.
+processes = None
 
 def status_git(path, ignore_set, options):
     """Run git status.
@@ -109,32 +619,360 @@ def status_git(path, ignore_set, options):
     * Text lines describing the status of the repository.
     * List of subrepository paths, relative to the repository itself.
     """
+    return follow(git_steps(path, ignore_set, options))
+
+def git_steps(path, ignore_set, options):
+    """Status generator behind `status_git()`."""
+    global _git_version, _git_fast_path
+    if options.native:
+        from uncommitted.native import git_is_clean
+        if git_is_clean(path, options):
+            yield [], []
+            return
+    if _git_version is None:
+        _git_version = parse_git_version(
+            (yield Run(('git', '--version'), path)))
+    if options.fsmonitor and _git_fast_path is None:
+        _git_fast_path = git_fast_path_features(_git_version, (yield Run(
+            ('git', 'version', '--build-options'), path)))
+    if _git_version >= GIT_PORCELAIN_V2_VERSION:
+        steps = git_porcelain_steps(path, ignore_set, options)
+    else:
+        steps = git_classic_steps(path, ignore_set, options)
+    request = next(steps)
+    while isinstance(request, Run):
+        request = steps.send((yield request))
+    yield request
+
+def status_git_classic(path, ignore_set, options):
+    """Run git status using one git command per kind of information."""
+    return follow(git_classic_steps(path, ignore_set, options))
+
+def git_classic_steps(path, ignore_set, options):
+    """Status generator behind `status_git_classic()`."""
     # Check whether current branch is dirty:
-    lines = [l for l in run(('git', 'status', '-s', '-b'), cwd=path)
+    command = git_status_command(path, options, True, '-s', '-b')
+    lines = [l for l in (yield Run(command, path))
              if (options.untracked or not l.startswith(b'?'))
              and not l.startswith(b'##')]
 
     # Check all branches for unpushed commits:
-    lines += [l for l in run(('git', 'branch', '-v'), cwd=path)
+    lines += [l for l in (yield Run(('git', 'branch', '-v'), path))
               if (b' [ahead ' in l)]
 
     # Check for non-tracking branches:
     if options.non_tracking:
-        lines += [l for l in run(('git', 'for-each-ref',
-                                  '--format=[%(refname:short)]%(upstream)',
-                                   'refs/heads'), cwd=path)
+        lines += [l for l in (yield Run(('git', 'for-each-ref',
+                                         '--format=[%(refname:short)]'
+                                         '%(upstream)', 'refs/heads'), path))
                   if l.endswith(b']')]
 
     if options.stash:
-        lines += [l for l in run(('git', 'stash', 'list'), cwd=path)]
+        lines += (yield Run(('git', 'stash', 'list'), path))
+
+    submodules = git_submodule_paths((yield Run(GIT_SUBMODULE_STATUS, path)))
+    yield lines, submodules
+
+def status_git_porcelain(path, ignore_set, options):
+    """Run git status using as few git commands as possible.
+
+    A single ``git status --porcelain=v2`` reports the dirty files and
+    whether there is a stash, and a single ``git for-each-ref`` reports
+    every branch and its upstream.  The lines returned are the same
+    ones that `status_git_classic()` builds from ``git status -s``,
+    ``git branch -v``, and friends.
+    """
+    return follow(git_porcelain_steps(path, ignore_set, options))
+
+def git_porcelain_steps(path, ignore_set, options, submodules=True):
+    """Status generator behind `status_git_porcelain()`.
+
+    Pass ``submodules=False`` to leave the submodules unlisted, when the
+    caller has already found them.
+    """
+    command = git_porcelain_status_command(path, options)
+    headers = {}
+    lines = []
+    for l in (yield Run(command, path)):
+        if l.startswith(b'# '):
+            key, _, value = l[2:].partition(b' ')
+            headers[key] = value
+        else:
+            lines.append(git_short_status(l))
+    lines = [l for l in lines if l is not None
+             and (options.untracked or not l.startswith(b'?'))]
+
+    branches = [l.split(b'\t', 6) for l in (yield Run(
+        ('git', 'for-each-ref', GIT_BRANCH_FORMAT, 'refs/heads'), path))]
+    branches = [b for b in branches if len(b) == 7]
+    width = max([len(b[1]) for b in branches] or [0])
+    ahead = [l for l in (git_branch_verbose_line(b, width) for b in branches)
+             if (b' [ahead ' in l)]
+    if ahead and (headers.get(b'branch.head') == b'(detached)' or
+                  any(c > 127 for b in branches for c in bytearray(b[1]))):
+        # `git branch -v` pads branch names to the width of the widest
+        # one, which we cannot predict when it also lists a detached
+        # HEAD or measures a non-ASCII name in display columns.
+        ahead = [l for l in (yield Run(('git', 'branch', '-v'), path))
+                 if (b' [ahead ' in l)]
+    lines += ahead
+
+    if options.non_tracking:
+        lines += [b'[' + b[2] + b']' for b in branches if not b[4]]
+
+    if options.stash and b'stash' in headers:
+        lines += (yield Run(GIT_STASH_LIST, path))
+
+    if not submodules:
+        submodules = []
+    elif not (os.path.exists(os.path.join(path, b'.gitmodules')) or any(
+            l.endswith(b' .gitmodules') for l in lines)):
+        submodules = []
+    elif options.batch_submodules:
+        steps = git_batched_submodule_steps(path, ignore_set, options)
+        request = next(steps)
+        while isinstance(request, Run):
+            request = steps.send((yield request))
+        submodules = request
+    else:
+        submodules = git_submodule_paths(
+            (yield Run(GIT_SUBMODULE_STATUS, path)))
+
+    yield lines, submodules
+
+def git_porcelain_status_command(path, options, untracked=None):
+    """Build the ``git status`` command behind `git_porcelain_steps()`.
+
+    Untracked files are only looked for if they will be reported, or if
+    the repository has submodules, since ``--untracked-files=no`` would
+    also hide a submodule whose only change is an untracked file, which
+    ``git status -s`` reports as `` ? path``.
+    """
+    if untracked is None:
+        untracked = options.untracked or os.path.exists(
+            os.path.join(path, b'.gitmodules'))
+    command = git_status_command(path, options, untracked,
+                                 '--porcelain=v2', '--branch', '--show-stash')
+    if not untracked:
+        command.append('--untracked-files=no')
+    return command
+
+def git_batched_submodule_steps(path, ignore_set, options):
+    """Find and check every submodule beneath `path` with one git command.
+
+    A single ``git submodule foreach --recursive`` prints, for each
+    submodule in turn, the output of each command that
+    `git_porcelain_steps()` runs for it.  That output is then handed to
+    `git_porcelain_steps()` in place of running the commands, so that
+    each submodule's lines are the same as when it is checked alone.
+    The result is a list of (relative path, lines) pairs, each nested
+    submodule right after its parent.
+    """
+    try:
+        from shlex import quote
+    except ImportError:  # Python 2
+        from pipes import quote
+    # Each submodule gets the same status command as when checked alone.
+    statuses = [git_porcelain_status_command(path, options, True),
+                git_porcelain_status_command(path, options, False)]
+    status_script = ' '.join(quote(arg) for arg in statuses[0])
+    if not options.untracked:
+        status_script = 'if test -f .gitmodules; then %s; else %s; fi' % (
+            status_script, ' '.join(quote(arg) for arg in statuses[1]))
+    branches = ('git', 'for-each-ref', GIT_BRANCH_FORMAT, 'refs/heads')
+    script = ["printf '\\000%s\\n' \"$displaypath\"",
+              status_script,
+              "printf '\\000\\n'",
+              ' '.join(quote(arg) for arg in branches)]
+    if options.stash:
+        script += ["printf '\\000\\n'", ' '.join(GIT_STASH_LIST)]
+    script.append('true')  # so that foreach goes on to the next one
+    lines = yield Run(('git', 'submodule', 'foreach', '--recursive',
+                       '--quiet', '; '.join(script)), path)
+
+    outputs = []
+    for l in lines:
+        if l.startswith(b'\0') and len(l) > 1:
+            outputs.append((l[1:], [[]]))
+        elif l.startswith(b'\0') and outputs:
+            outputs[-1][1].append([])
+        elif outputs:
+            outputs[-1][1][-1].append(l)
+
+    submodules = []
+    for relative_path, sections in outputs:
+        answers = dict(zip([tuple(statuses[0]), branches, GIT_STASH_LIST],
+                           sections))
+        if answers:
+            answers[tuple(statuses[1])] = sections[0]
+        steps = git_porcelain_steps(os.path.join(path, relative_path),
+                                    ignore_set, options, submodules=False)
+        request = next(steps)
+        while isinstance(request, Run):
+            answer = answers.get(tuple(request.command))
+            if answer is None:
+                answer = yield request
+            request = steps.send(answer)
+        submodules.append((relative_path, request[0]))
+    yield submodules
+
+def git_probe_steps(path, ignore_set, options):
+    """Status generator for --any, which stops at the first sign of work.
+
+    ``git diff-index --quiet`` stops at the first tracked file whose
+    details differ from HEAD, without reading the contents of any file,
+    so it is only trusted when it says that nothing has changed; if it
+    finds something, ``git status`` has the final word.  It has it in a
+    repository with submodules too, as diff-index does not see a
+    submodule whose only change is an untracked file.  A single ``git
+    for-each-ref`` then finds any branch that is ahead of its upstream,
+    and the stash.  If git cannot compare against HEAD at all, as in a
+    repository without commits, the full `git_steps()` are taken instead.
+    """
+    if options.native:
+        from uncommitted.native import git_is_clean
+        if git_is_clean(path, options):
+            yield [], []
+            return
+    exit_code = yield Probe(('git', 'diff-index', '--quiet', 'HEAD', '--'),
+                            path)
+    if exit_code not in (0, 1):
+        steps = git_steps(path, ignore_set, options)
+        request = next(steps)
+        while isinstance(request, Run):
+            request = steps.send((yield request))
+        yield request
+        return
+    # Such a submodule would also be hidden by --untracked-files=no.
+    submodules = os.path.exists(os.path.join(path, b'.gitmodules'))
+    if exit_code or options.untracked or submodules:
+        command = ['git', 'status', '--porcelain']
+        if not (options.untracked or submodules):
+            command.append('--untracked-files=no')
+        lines = [l for l in (yield Run(command, path))
+                 if options.untracked or not l.startswith(b'?')]
+        if lines:
+            yield lines, []
+            return
+    lines = []
+    for l in (yield Run(('git', 'for-each-ref', GIT_PROBE_FORMAT,
+                         'refs/heads', 'refs/stash'), path)):
+        refname, upstream, track = l.split(b'\t')
+        if refname == b'refs/stash':
+            if options.stash:
+                lines.append(b'stash')
+        elif track.startswith(b'>') or track.startswith(b'<>'):
+            lines.append(refname[11:] + b' [ahead]')
+        elif options.non_tracking and not upstream:
+            lines.append(b'[' + refname[11:] + b']')
+    if lines or not os.path.exists(os.path.join(path, b'.gitmodules')):
+        yield lines, []
+        return
+    yield [], git_submodule_paths((yield Run(GIT_SUBMODULE_STATUS, path)))
+
+GIT_PORCELAIN_V2_VERSION = (2, 35)  # first to report the stash in v2
+GIT_SUBMODULE_STATUS = ('git', 'submodule', 'status')
+GIT_STASH_LIST = ('git', 'stash', 'list')
+GIT_PROBE_FORMAT = '--format=%(refname)\t%(upstream)\t%(upstream:trackshort)'
+GIT_BRANCH_FORMAT = ('--format=%(HEAD)%(if)%(worktreepath)%(then)+%(end)'
+                     '\t%(refname:lstrip=2)\t%(refname:short)'
+                     '\t%(objectname:short)\t%(upstream)'
+                     '\t%(upstream:track)\t%(contents:subject)')
+
+GIT_FSMONITOR_VERSION = (2, 36)  # first with a built-in fsmonitor daemon
+GIT_UNTRACKED_CACHE_VERSION = (2, 8)  # first with core.untrackedCache
+
+def git_fast_path_features(version, build_options):
+    """Return the --fsmonitor features that this git supports.
 
+    Each is a (name, setting) pair.  The built-in fsmonitor daemon is only
+    compiled in on some platforms, which ``git version --build-options``
+    lists as a feature.
+    """
+    features = []
+    if (version >= GIT_FSMONITOR_VERSION and
+            b'feature: fsmonitor--daemon' in build_options):
+        features.append((b'fsmonitor', 'core.fsmonitor=true'))
+    if version >= GIT_UNTRACKED_CACHE_VERSION:
+        features.append((b'untracked cache', 'core.untrackedCache=true'))
+    return features
+
+def git_status_command(path, options, untracked, *args):
+    """Build a ``git status`` command, turning on the --fsmonitor features.
+
+    The untracked cache is left out if the command will not be listing
+    `untracked` files anyway.  Repositories that get any features are
+    noted in the timings as having taken the fast path.
+    """
+    command = ['git']
+    features = []
+    if options.fsmonitor and _git_fast_path:
+        features = [(name, setting) for name, setting in _git_fast_path
+                    if untracked or name != b'untracked cache']
+    for name, setting in features:
+        command += ['-c', setting]
+    if features and timings is not None:
+        timings.fast_path(path, [name for name, setting in features])
+    return command + ['status'] + list(args)
+
+def git_short_status(line):
+    """Turn a ``--porcelain=v2`` status line into a ``-s`` status line.
+
+    Returns None for lines that short format would not print.
+    """
+    kind = line[:1]
+    if kind == b'1':
+        fields = line.split(b' ', 8)
+        paths = [fields[8]]
+    elif kind == b'2':
+        fields = line.split(b' ', 9)
+        paths = fields[9].split(b'\t')[::-1]
+    elif kind == b'u':
+        fields = line.split(b' ', 10)
+        paths = [fields[10]]
+    elif kind == b'?':
+        return b'?? ' + git_quote_space(line[2:])
+    else:
+        return None
+    xy = fields[1].replace(b'.', b' ')
+    submodule = fields[2]  # S<c><m><u> for a submodule
+    if (xy[1:] == b'M' and submodule.startswith(b'S')
+            and submodule[1:2] != b'C'):
+        # Short format tells a submodule without new commits apart by
+        # whether its content is modified or merely untracked.
+        if submodule[2:3] == b'M':
+            xy = xy[:1] + b'm'
+        elif submodule[3:4] == b'U':
+            xy = xy[:1] + b'?'
+    return xy + b' ' + b' -> '.join(git_quote_space(p) for p in paths)
+
+def git_quote_space(path):
+    """Quote a path with spaces, as git's short format does."""
+    if b' ' in path and not path.startswith(b'"'):
+        return b'"' + path + b'"'
+    return path
+
+def git_branch_verbose_line(branch, width):
+    """Rebuild the `git branch -v` line for a `GIT_BRANCH_FORMAT` branch."""
+    head, name, short, sha, upstream, track, subject = branch
+    if head.startswith(b'*'):
+        prefix = b'* '
+    elif head.endswith(b'+'):
+        prefix = b'+ '
+    else:
+        prefix = b'  '
+    if track:
+        track += b' '
+    return prefix + name.ljust(width) + b' ' + sha + b' ' + track + subject
+
+def git_submodule_paths(lines):
+    """Return the submodule paths listed by ``git submodule status``."""
     discovered_submodules = []
-    for l in run(('git', 'submodule', 'status'), cwd=path):
+    for l in lines:
         match = git_submodule.search(l)
         if match:
             discovered_submodules.append(match.group(1))
-
-    return lines, discovered_submodules
+    return discovered_submodules
 
 def status_subversion(path, ignore_set, options):
     """Run svn status.
@@ -143,66 +981,660 @@ def status_subversion(path, ignore_set, options):
     * Text lines describing the status of the repository.
     * Empty sequence of subrepos, since svn does not support them.
     """
+    return follow(subversion_steps(path, ignore_set, options))
+
+def subversion_steps(path, ignore_set, options):
+    """Status generator behind `status_subversion()`.
+
+    A single ``svn status`` at the root of a working copy covers every
+    versioned directory beneath it, including the ``.svn`` directories
+    that pre-1.7 clients put in each one.  So the `ignore_set`, which is
+    a `PathTrie`, records the root as covered, and the unversioned,
+    ignored, and external directories inside it as not covered, since
+    another working copy could live in one of those.  A later path is
+    skipped when the nearest of these recorded directories above it is
+    covered.  Files are never recorded, as nothing can live inside one.
+    """
+    from subprocess import CalledProcessError
     subrepos = ()
-    if path in ignore_set:
-        return None, subrepos
+    if ignore_set.covers(path):
+        yield None, subrepos
+        return
+    chunks = yield Stream(['svn', 'status', '--xml', '--no-ignore'], path)
+    uncovered = []
     keepers = []
-    for line in run(['svn', 'st', '-v'], cwd=path):
-        if not line.strip():
-            continue
-        if line.startswith(b'Performing') or line[0] in b'X?':
-            continue
-        status = line[:8]
-        ignored_states = options.ignore_svn_states
-        if ignored_states and status.strip() in ignored_states:
-            continue
-        filename = line[8:].split(None, 3)[-1]
-        ignore_set.add(os.path.join(path, filename))
-        if status.strip():
-            keepers.append(b' ' + status + filename)
-    return keepers, subrepos
+    try:
+        for filename, wc_status in svn_entries(chunks, path):
+            if wc_status.get('item') in SVN_UNCOVERED_ITEMS:
+                # Only a directory can hold a working copy of its own, so
+                # files are left out of the trie to keep it small.
+                entry = os.path.join(path, filename)
+                if os.path.isdir(entry):
+                    uncovered.append(entry)
+                continue
+            status = svn_status_columns(wc_status)
+            ignored_states = options.ignore_svn_states
+            if ignored_states and status.strip() in ignored_states:
+                continue
+            if status.strip():
+                keepers.append(b' ' + status + filename)
+    except CalledProcessError:
+        yield [], subrepos
+        return
+    ignore_set.cover(path)
+    for entry in uncovered:
+        ignore_set.exclude(entry)
+    yield keepers, subrepos
+
+def svn_entries(chunks, path):
+    """Generate a (path, wc-status element) pair for each status entry.
+
+    The `chunks` of XML are parsed as they arrive, and each entry is
+    discarded once it has been handled, so that neither the output nor
+    the parsed tree is ever held in memory all at once.  Malformed XML
+    raises `ErrorBadOutput` for the working copy at `path`, since the
+    entries it would have listed cannot be known.
+    """
+    from xml.etree.ElementTree import ParseError, iterparse
+    try:
+        for event, element in iterparse(ChunkReader(chunks)):
+            if element.tag == 'entry':
+                wc_status = element.find('wc-status')
+                if wc_status is not None:
+                    yield element.get('path').encode('utf-8'), wc_status
+                element.clear()
+    except ParseError:
+        raise ErrorBadOutput(path, 'svn')
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+class ChunkReader(object):
+    """A file whose `read()` returns each of the `chunks` in turn."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def read(self, size=-1):
+        return next(self.chunks, b'')
+
+SVN_UNCOVERED_ITEMS = ('unversioned', 'ignored', 'external')
+SVN_ITEM_CODES = {
+    'added': b'A', 'conflicted': b'C', 'deleted': b'D', 'external': b'X',
+    'ignored': b'I', 'incomplete': b'!', 'missing': b'!', 'modified': b'M',
+    'obstructed': b'~', 'replaced': b'R', 'unversioned': b'?',
+    }
+SVN_PROPS_CODES = {'conflicted': b'C', 'modified': b'M'}
+
+def svn_status_columns(wc_status):
+    """Rebuild the seven status columns that ``svn status`` prints.
+
+    A space is added at the end, as in the text output.
+    """
+    def flag(name, code):
+        return code if wc_status.get(name) == 'true' else b' '
+    return b''.join([
+        SVN_ITEM_CODES.get(wc_status.get('item'), b' '),
+        SVN_PROPS_CODES.get(wc_status.get('props'), b' '),
+        flag('wc-locked', b'L'),
+        flag('copied', b'+'),
+        flag('switched', b'S') if wc_status.get('switched') == 'true'
+        else flag('file-external', b'X'),
+        b'K' if wc_status.find('lock') is not None else b' ',
+        flag('tree-conflicted', b'C'),
+        b' ',
+        ])
 
 SYSTEMS = {
-    b'.git': (b'Git', status_git),
-    b'.hg': (b'Mercurial', status_mercurial),
-    b'.svn': (b'Subversion', status_subversion),
+    b'.git': (b'Git', git_steps),
+    b'.hg': (b'Mercurial', mercurial_steps),
+    b'.svn': (b'Subversion', subversion_steps),
     }
 DOTDIRS = set(SYSTEMS)
 
-def scan(repos, options):
-    """Given a repository list [(path, vcsname), ...], scan each of them."""
-    ignore_set = set()
-    repos = repos[::-1]  # Create a queue we can push and pop from
-    while repos:
-        directory, dotdir = repos.pop()
-        ignore_this = any(pat in directory for pat in options.ignore_patterns)
-        if ignore_this:
-            if options.verbose:
-                output(b'Ignoring repo: %s' % directory)
-                output(b'')
+# The cheaper status generators used by --any, where there are any.
+PROBES = {
+    b'.git': git_probe_steps,
+    b'.hg': mercurial_probe_steps,
+    }
+
+Report = namedtuple('Report', 'directory vcsname lines error duration')
+
+def check(directory, dotdir, ignore_set, options, cache=None):
+    """Check a repository and its subrepos, returning a list of reports.
+
+    Each `Report` names a repository directory and its version control
+    system, together with either the repository's status lines or the
+    exception that prevented us from getting them, and the number of
+    seconds that the check took.  The `lines` are None for a repository
+    whose status function asked to be skipped, and the `vcsname` is None
+    for a repository the user told us to ignore.  Subrepos are reported
+    immediately after their parent.
+    Statuses are looked up in, and saved to, the `cache` if one is given.
+    A repository that runs out of time has an `ErrorTimedOut` as its
+    error, one that the deadline passed before has `ErrorNotChecked`,
+    and one whose status output cannot be parsed has `ErrorBadOutput`.
+    """
+    return follow(check_steps(directory, dotdir, ignore_set, options, cache))
+
+def check_steps(directory, dotdir, ignore_set, options, cache=None):
+    """Status generator behind `check()`."""
+    reports = []
+    queue = [(directory, dotdir, None)]
+    while queue:
+        directory, dotdir, known = queue.pop()
+        if is_ignored(directory, options.ignore):
+            reports.append(Report(directory, None, None, None, 0.0))
+            # Skip any subrepos inside it that were checked along with it.
+            prefix = os.path.join(directory, b'')
+            queue = [q for q in queue if not q[0].startswith(prefix)]
             continue
 
-        vcsname, get_status = SYSTEMS[dotdir]
-        try:
-            lines, subrepos = get_status(directory, ignore_set, options)
-        except ErrorCommandMissing as e:
-            output(b'%s - skipping: %r command not found\n' % e.args)
+        vcsname, steps = SYSTEMS[dotdir]
+        if options.any:
+            steps = PROBES.get(dotdir, steps)
+        start = time()
+        if (known is None and options.deadline is not None
+                and start >= options.deadline):
+            reports.append(Report(directory, vcsname, None,
+                                  ErrorNotChecked(directory), 0.0))
             continue
+        repo_deadline = None
+        if options.repo_timeout is not None:
+            repo_deadline = start + options.repo_timeout
+        cached = None
+        if cache is not None and known is None:
+            key = cache.key(directory, dotdir, options)
+            fingerprint = cache.fingerprint(directory, dotdir, options)
+            cached = cache.lookup(key, fingerprint)
+        if known is not None:
+            lines, subrepos = known, ()
+        elif cached is not None:
+            lines, subrepos = cached
+        else:
+            status = steps(directory, ignore_set, options)
+            try:
+                request = next(status)
+                while isinstance(request, Run):
+                    timeout = time_left(options, repo_deadline)
+                    if timeout is not None:
+                        if timeout <= 0:
+                            raise ErrorTimedOut(request.cwd,
+                                                request.command[0])
+                        request = request._replace(timeout=timeout)
+                    request = status.send((yield request))
+            except (ErrorCommandMissing, ErrorTimedOut,
+                    ErrorBadOutput) as e:
+                reports.append(Report(directory, vcsname, None, e,
+                                      time() - start))
+                if timings is not None:
+                    timings.repository(reports[-1], start, False)
+                continue
+            lines, subrepos = request
+            if cache is not None and not options.any:
+                cache.store(key, fingerprint, lines, subrepos)
 
         # We want to tackle subrepos immediately after their repository,
-        # so we put them at the front of the queue.
-        subrepos = [(os.path.join(directory, r), dotdir) for r in subrepos]
-        repos.extend(reversed(subrepos))
+        # so we put them at the front of the queue.  A subrepo that was
+        # already checked along with its parent comes with its lines.
+        subrepos = [(os.path.join(directory, r), dotdir, None)
+                    if isinstance(r, bytes) else
+                    (os.path.join(directory, r[0]), dotdir, r[1])
+                    for r in subrepos]
+        queue.extend(reversed(subrepos))
+
+        reports.append(Report(directory, vcsname, lines, None,
+                              time() - start))
+        if timings is not None:
+            timings.repository(reports[-1], start, cached is not None)
+    yield reports
+
+def time_left(options, repo_deadline):
+    """Return how long the next command can run, or None if it has no limit.
+
+    That is the shortest of the --timeout for each command, the time left
+    until the `repo_deadline`, and the time left until the --deadline.
+    """
+    now = time()
+    limits = [options.timeout]
+    if repo_deadline is not None:
+        limits.append(repo_deadline - now)
+    if options.deadline is not None:
+        limits.append(options.deadline - now)
+    limits = [limit for limit in limits if limit is not None]
+    return min(limits) if limits else None
+
+def check_concurrently(repos, ignore_set, options, cache=None):
+    """Check repositories using a pool of threads, yielding reports in order.
+
+    Subversion repositories are checked one at a time, in order, from
+    the calling thread, because whether a nested Subversion directory
+    gets skipped depends on the `ignore_set` entries that its parent
+    working copy has already added.
+    """
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(options.jobs)
+    try:
+        results = [None if dotdir == b'.svn' else
+                   pool.apply_async(check, (directory, dotdir, ignore_set,
+                                            options, cache))
+                   for directory, dotdir in repos]
+        for (directory, dotdir), result in zip(repos, results):
+            if result is None:
+                reports = check(directory, dotdir, ignore_set, options,
+                                cache)
+            else:
+                reports = result.get()
+            for report in reports:
+                yield report
+    finally:
+        pool.terminate()
+        pool.join()
+
+def check_as_discovered(repos, ignore_set, options, cache=None):
+    """Check repositories while they are still being discovered.
+
+    The `repos` iterable is consumed in a background thread that hands
+    each repository to a pool of threads as soon as it appears.  Reports
+    are generated in the order that the checks finish, each repository
+    still followed by its subrepos.  Subversion repositories get a pool
+    of their own with a single thread, so that they are checked one at
+    a time in the order discovered, which puts each working copy ahead
+    of the nested ``.svn`` directories that its `ignore_set` entries
+    might cover.
+    """
+    from multiprocessing.pool import ThreadPool
+    from threading import Thread
+    try:
+        from queue import Queue
+    except ImportError:  # Python 2
+        from Queue import Queue
+    pool = ThreadPool(options.jobs)
+    svn_pool = ThreadPool(1)
+    results = Queue()
+
+    def task(directory, dotdir):
+        try:
+            return check(directory, dotdir, ignore_set, options, cache)
+        except Exception as e:
+            return e
+
+    def dispatch():
+        try:
+            for directory, dotdir in repos:
+                p = svn_pool if dotdir == b'.svn' else pool
+                p.apply_async(task, (directory, dotdir),
+                              callback=results.put)
+            for p in pool, svn_pool:
+                p.close()
+                p.join()
+        except Exception as e:
+            results.put(e)
+        results.put(None)
+
+    thread = Thread(target=dispatch)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            reports = results.get()
+            if reports is None:
+                break
+            if isinstance(reports, Exception):
+                raise reports
+            for report in reports:
+                yield report
+    finally:
+        for p in pool, svn_pool:
+            p.terminate()
+
+def write_report(report, options):
+    """Print a repository report."""
+    for line in report_lines(report, options):
+        output(line)
+
+def report_lines(report, options):
+    """Generate the lines of text that describe a repository report."""
+    directory, vcsname, lines, error, duration = report
+    if vcsname is None:
+        if options.verbose:
+            yield b'Ignoring repo: %s' % directory
+            yield b''
+    elif isinstance(error, ErrorCommandMissing):
+        yield b'%s - skipping: %r command not found\n' % error.args
+    elif isinstance(error, ErrorTimedOut):
+        yield b'%s - timed out: %r command killed\n' % error.args
+    elif isinstance(error, ErrorBadOutput):
+        yield b'%s - bad output: %r command output not understood\n' % (
+            error.args)
+    elif error is not None:
+        yield b'%s - not checked: the deadline passed\n' % error.args
+    elif lines is None:  # signal that we should ignore this one
+        pass
+    elif lines or options.verbose:
+        yield b'%s - %s' % (directory, vcsname)
+        for line in lines:
+            yield line
+        yield b''
+
+def describe(report, options):
+    """Return a report as a dictionary, or None if it should not be shown.
+
+    Strings are decoded from the filesystem encoding, so that the
+    dictionary can be rendered as JSON.
+    """
+    directory, vcsname, lines, error, duration = report
+    if vcsname is None:
+        return None
+    if error is None and (lines is None or not (lines or options.verbose)):
+        return None
+    record = {
+        'path': decode(directory),
+        'vcs': decode(vcsname),
+        'duration': round(duration, 6),
+        'files': [],
+        'branches': [],
+        'non_tracking': [] if options.non_tracking else None,
+        'stash': 0 if options.stash else None,
+        }
+    if isinstance(error, ErrorCommandMissing):
+        record['error'] = '%s command not found' % (error.args[1],)
+        return record
+    if isinstance(error, ErrorTimedOut):
+        record['error'] = '%s command timed out' % (error.args[1],)
+        return record
+    if isinstance(error, ErrorBadOutput):
+        record['error'] = '%s command output not understood' % (
+            error.args[1],)
+        return record
+    if error is not None:
+        record['error'] = 'not checked before the deadline'
+        return record
+    for line in lines:
+        if vcsname == b'Git' and line.startswith(b'stash@{'):
+            record['stash'] += 1
+        elif vcsname == b'Git' and line.startswith(b'['):
+            record['non_tracking'].append(decode(line[1:-1]))
+        elif vcsname == b'Git' and line[:2] in (b'* ', b'+ ', b'  '):
+            match = git_ahead_behind.search(line)
+            record['branches'].append({
+                'name': decode(line[2:].split()[0]),
+                'ahead': int(match.group(1)) if match else 0,
+                'behind': int(match.group(2) or 0) if match else 0,
+                })
+        elif vcsname == b'Git':
+            paths = [git_unquote(p) for p in git_path.findall(line[3:])
+                     if p != b'->']
+            record['files'].append({'status': decode(line[:2]),
+                                    'path': decode(paths[-1])})
+            if len(paths) > 1:
+                record['files'][-1]['original_path'] = decode(paths[0])
+        elif vcsname == b'Subversion':
+            record['files'].append({'status': decode(line[1:8].rstrip()),
+                                    'path': decode(line[9:])})
+        else:
+            record['files'].append({'status': decode(line[1:2]),
+                                    'path': decode(line[3:])})
+    return record
+
+def git_unquote(path):
+    """Undo the C-style quoting that git applies to unusual paths."""
+    if not path.startswith(b'"'):
+        return path
+    return git_escape.sub(lambda m: GIT_ESCAPES.get(m.group(1)) or
+                          bytes(bytearray([int(m.group(1), 8)])), path[1:-1])
+
+GIT_ESCAPES = {b'a': b'\a', b'b': b'\b', b't': b'\t', b'n': b'\n',
+               b'v': b'\v', b'f': b'\f', b'r': b'\r', b'"': b'"',
+               b'\\': b'\\'}
+
+def decode(b):
+    """Decode bytes from the filesystem encoding, for JSON."""
+    if sys.version_info[0] >= 3:
+        return os.fsdecode(b)
+    return b.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+
+def scan(repos, options):
+    """Given a repository list [(path, vcsname), ...], scan each of them.
 
-        if lines is None:  # signal that we should ignore this one
+    With the `stream` option, `repos` can instead be an iterable that
+    is still discovering repositories as the scan proceeds.  With the
+    `any` option, the scan stops at the first repository found to have
+    uncommitted work, and returns whether there was one.
+    """
+    global processes
+    # The directories covered by Subversion working copies already checked.
+    ignore_set = PathTrie()
+    processes = Processes() if options.any else None
+    cache = None
+    if options.use_cache:
+        from uncommitted.cache import ScanCache, default_path
+        cache = ScanCache(default_path())
+    if options.asyncio:
+        from uncommitted.aio import check_with_asyncio
+        reports = check_with_asyncio(repos, ignore_set, options, cache)
+    elif options.stream or options.any:
+        reports = check_as_discovered(repos, ignore_set, options, cache)
+    elif options.jobs > 1:
+        reports = check_concurrently(repos, ignore_set, options, cache)
+    else:
+        reports = (report for directory, dotdir in repos for report
+                   in check(directory, dotdir, ignore_set, options, cache))
+    if timings is not None:
+        reports = timings.phase('status', reports)
+    found = []
+    if options.summary_file:
+        reports = with_work(reports, found)
+    if options.any:
+        found = None
+        for report in reports:
+            if report.vcsname is not None and report.lines:
+                found = report
+                break
+        # Stop the checks that are still running, and their commands.
+        processes.kill()
+        if hg_servers is not None:
+            hg_servers.kill()
+        reports.close()
+        if found is not None and not options.quiet:
+            output(b'%s - %s' % (found.directory, found.vcsname))
+        if cache is not None:
+            save(cache, 'cache')
+        return found is not None
+    if options.format == 'text':
+        for report in reports:
+            write_report(report, options)
+    else:
+        import json
+        records = (describe(report, options) for report in reports)
+        records = (record for record in records if record is not None)
+        if options.format == 'ndjson':
+            for record in records:
+                output(json.dumps(record, sort_keys=True).encode('ascii'))
+        else:
+            output(json.dumps(list(records), indent=2, sort_keys=True,
+                              separators=(',', ': ')).encode('ascii'))
+    if options.summary_file:
+        write_atomically(options.summary_file, b'%d\n' % len(found))
+    if cache is not None:
+        save(cache, 'cache')
+
+def with_work(reports, found):
+    """Generate `reports`, adding each repository with work to `found`."""
+    for report in reports:
+        if report.vcsname is not None and report.lines:
+            found.append(report.directory)
+        yield report
+
+def compile_ignore_patterns(patterns):
+    """Compile the -I patterns into one regular expression, or None.
+
+    A pattern that starts with ``re:`` is a regular expression to search
+    for in each path, and one that starts with ``glob:`` is a shell glob
+    that has to match one or more whole path components, where ``**``
+    can match across components and a leading separator anchors it to
+    the top of the filesystem.  Any other pattern matches wherever it
+    appears in a path, as it always has.
+    """
+    if not patterns:
+        return None
+    import re
+    alternatives = []
+    for pattern in patterns:
+        if pattern.startswith(b're:'):
+            alternatives.append(pattern[3:])
+        elif pattern.startswith(b'glob:'):
+            alternatives.append(glob_regex(pattern[5:]))
+        else:
+            alternatives.append(re.escape(pattern))
+    return re.compile(b'|'.join(b'(?:' + a + b')' for a in alternatives))
+
+def glob_regex(glob):
+    """Translate a shell glob into a regular expression for paths."""
+    import re
+    component = b'[^' + re.escape(sep) + b']'
+    parts = [b'^' if glob.startswith(sep) else b'(?:^|' + re.escape(sep)
+             + b')']
+    i = 0
+    while i < len(glob):
+        c = glob[i:i + 1]
+        i += 1
+        if c == b'*' and glob[i:i + 2] == b'*' + sep:
+            parts.append(b'(?:.*' + re.escape(sep) + b')?')
+            i += 2
+        elif c == b'*' and glob[i:i + 1] == b'*':
+            parts.append(b'.*')
+            i += 1
+        elif c == b'*':
+            parts.append(component + b'*')
+        elif c == b'?':
+            parts.append(component)
+        elif c == b'[' and b']' in glob[i + 1:]:
+            end = glob.index(b']', i + 1)
+            chars = glob[i:end]
+            if chars.startswith(b'!'):
+                chars = b'^' + chars[1:]
+            parts.append(b'[' + chars.replace(b'\\', b'\\\\') + b']')
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+    parts.append(b'(?=' + re.escape(sep) + b'|$)')
+    return b''.join(parts)
+
+def is_ignored(path, ignore):
+    """Return whether `path`, or a directory above it, matches `ignore`."""
+    if ignore is None:
+        return False
+    while True:
+        if ignore.search(path):
+            return True
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+
+def find_all_repositories(paths, find_repos, prune, processes=1,
+                          ignore=None, unique=True):
+    """Generate each (directory, dotdir) pair beneath `paths` once.
+
+    A path inside another is not searched on its own, unless the search
+    of the outer one might not reach it.  If `processes` is more than 1,
+    that many paths are searched at once, each in a worker process, and
+    the repositories beneath each path are generated as soon as its
+    search is complete.  If `unique` is false, a repository that can be
+    reached from two of the paths is generated twice, for callers that
+    will sort the repositories and can drop duplicates with less memory
+    than it takes to remember every repository generated.
+    """
+    roots = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            sys.stderr.write('Error: not a directory: %s\n' % (path,))
             continue
-        if lines or options.verbose:
-            output(b'%s - %s' % (directory, vcsname))
-            for line in lines:
-                output(line)
-            output(b'')
+        roots.append(path)
+    roots = outermost_roots(roots, prune, ignore)
+
+    seen = set()
+    if processes > 1 and len(roots) > 1:
+        from multiprocessing import Pool
+        pool = Pool(min(processes, len(roots)))
+    else:
+        pool = None
+    try:
+        if pool is None:
+            results = (find_repos(root, prune) for root in roots)
+        else:
+            results = pool.imap_unordered(
+                find_repositories_in_worker,
+                [(find_repos, root, prune) for root in roots])
+        for repos in results:
+            for repo in repos:
+                if not unique:
+                    yield repo
+                elif repo not in seen:
+                    seen.add(repo)
+                    yield repo
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def find_repositories_in_worker(job):
+    """Return the repositories beneath a path, for a worker process."""
+    find_repos, path, prune = job
+    return list(find_repos(path, prune))
+
+def sorted_unique(items):
+    """Return a sorted list of `items` without duplicates."""
+    items = sorted(items)
+    n = 0
+    for item in items:
+        if not n or item != items[n - 1]:
+            items[n] = item
+            n += 1
+    del items[n:]
+    return items
+
+def outermost_roots(paths, prune, ignore=None):
+    """Return `paths`, without those that are inside one of the others.
+
+    A path is only dropped if every directory between it and the outer
+    path, itself included, would be searched: none is a symbolic link,
+    a version control directory, or a directory that is pruned or
+    ignored.  Paths keep their order.
+    """
+    roots = []
+    for path in sorted(set(paths)):
+        if not any(path.startswith(os.path.join(root, b''))
+                   and reaches(root, path, prune, ignore) for root in roots):
+            roots.append(path)
+    roots = set(roots)
+    kept = []
+    for path in paths:
+        if path in roots and path not in kept:
+            kept.append(path)
+    return kept
+
+def reaches(outer, path, prune, ignore):
+    """Return whether a search of `outer` is sure to search `path` too."""
+    while path != outer:
+        name = os.path.basename(path)
+        if (name in prune or name in DOTDIRS or os.path.islink(path) or
+                (ignore is not None and ignore.search(path))):
+            return False
+        path = os.path.dirname(path)
+    return True
 
 def main():
+    global timings, hg_servers
+    if '--prompt' in sys.argv[1:]:
+        # Shell prompts cannot wait, so answer before even parsing options.
+        from uncommitted.prompt import prompt
+        exit(prompt(sys.argv[1:]))
+    from functools import partial
+    from optparse import OptionParser
     parser = OptionParser(usage=USAGE)
     parser.add_option('-l', '--locate', dest='use_locate', action='store_true',
         help='use locate(1) to find repositories (instead of walking)')
@@ -220,47 +1652,280 @@ def main():
         help='print stash (git only)')
     parser.add_option('-I', dest='ignore_patterns', action='append',
         default=[],
-        help='ignore any directory paths that contain the specified string')
+        help='ignore any directory paths that contain the specified string,'
+        ' or that match it if it starts with "glob:" (a shell glob) or'
+        ' "re:" (a regular expression)')
+    parser.add_option('--ignore-file', dest='ignore_files', action='append',
+        default=[], metavar='FILE',
+        help='read more -I patterns from FILE, one per line, skipping blank'
+        ' lines and lines that start with "#"')
     parser.add_option(
         '--ignore-svn-states',
         help='ignore SVN states given as a string of status codes (SVN only)')
+    parser.add_option('-j', '--jobs', type='int', default=1, metavar='N',
+        help='check up to N repositories at once (default: 1)')
+    parser.add_option('--no-cache', dest='use_cache', action='store_false',
+        default=True,
+        help='check every repository, instead of trusting the results'
+        ' cached for ones that have not changed since the last run')
+    parser.add_option('--prune', action='append', default=[], metavar='NAME',
+        help='do not look for repositories inside directories named NAME'
+        ' (such as node_modules); may be given more than once')
+    parser.add_option('--walk-threads', type='int', default=1, metavar='N',
+        help='list up to N directories at once while walking, which helps'
+        ' on network filesystems (default: 1)')
+    parser.add_option('--walk-processes', type='int', default=1,
+        metavar='N',
+        help='search up to N of the paths given at once, each in a worker'
+        ' process, which helps when they are on different disks or mounts'
+        ' (default: 1)')
+    parser.add_option('--stream', action='store_true',
+        help='start checking repositories while still looking for more,'
+        ' and print each one as soon as it has been checked, instead of'
+        ' in sorted order')
+    parser.add_option('--asyncio', action='store_true',
+        help='check repositories from a single thread using asyncio,'
+        ' running up to --jobs commands at once (Python 3 only)')
+    parser.add_option('--format', type='choice', default='text',
+        choices=['text', 'json', 'ndjson'],
+        help='print a text report (the default), a JSON list of'
+        ' repositories, or one JSON object per line (ndjson) as each'
+        ' repository is checked')
+    parser.add_option('--index', metavar='PATH',
+        help='remember where repositories are in the index file PATH, and'
+        ' on later runs only re-read directories that have changed')
+    parser.add_option('--reindex', action='store_true',
+        help='ignore the current contents of the --index file and walk'
+        ' every directory again')
+    parser.add_option('--hg-server', action='store_true',
+        help='run Mercurial commands through long-lived "hg serve'
+        ' --cmdserver" processes instead of starting hg for each'
+        ' repository (Mercurial only)')
+    parser.add_option('--batch-submodules', action='store_true',
+        help='check all of the submodules beneath a repository with a single'
+        ' "git submodule foreach" instead of separate git commands for'
+        ' each one (git 2.35 or later)')
+    parser.add_option('--native', action='store_true',
+        help='read the files of each git repository to decide whether it'
+        ' is clean, and only run git if it might not be (git only)')
+    parser.add_option('--watch', action='store_true',
+        help='keep running, watching the repositories with inotify and'
+        ' checking each one again whenever it changes; the report goes to'
+        ' --state-file or --socket instead of standard output (Linux only)')
+    parser.add_option('--state-file', metavar='FILE',
+        help='with --watch, keep the latest report in FILE, replacing it'
+        ' all at once whenever it changes')
+    parser.add_option('--socket', metavar='PATH',
+        help='with --watch, send the latest report to each client that'
+        ' connects to a Unix socket at PATH')
+    parser.add_option('--debounce', type='float', default=0.5,
+        metavar='SECONDS',
+        help='with --watch, wait until a repository has not changed for'
+        ' SECONDS before checking it again (default: 0.5)')
+    parser.add_option('--fsmonitor', action='store_true',
+        help='have git status use its fsmonitor daemon and untracked cache,'
+        ' where this version of git supports them, so that large'
+        ' repositories are not scanned in full (git only)')
+    parser.add_option('--any', action='store_true',
+        help='only find out whether any repository has uncommitted work,'
+        ' using the cheapest checks and stopping at the first repository'
+        ' found, which is printed; exits with status 1 if there is one')
+    parser.add_option('-q', '--quiet', action='store_true',
+        help='like --any, but print nothing')
+    parser.add_option('--timeout', type='float', metavar='SECONDS',
+        help='kill any version control command that is still running after'
+        ' SECONDS, with any processes it started, and report its'
+        ' repository as timed out')
+    parser.add_option('--repo-timeout', type='float', metavar='SECONDS',
+        help='likewise give up on any repository whose commands have taken'
+        ' SECONDS in all')
+    parser.add_option('--deadline', dest='deadline_seconds', type='float',
+        metavar='SECONDS',
+        help='stop checking SECONDS after starting, listing the'
+        ' repositories that are left as not checked')
+    parser.add_option('--prompt', action='store_true',
+        help='print how many repositories had uncommitted work when last'
+        ' scanned with the same arguments, in milliseconds, for a shell'
+        ' prompt; if that scan is older than --prompt-ttl, start a new one'
+        ' in the background')
+    parser.add_option('--prompt-ttl', type='float', metavar='SECONDS',
+        help='with --prompt, how old a scan can be before a new one is'
+        ' started, and how often new ones can start (default: 60)')
+    parser.add_option('--summary-file', metavar='FILE',
+        help='also write the number of repositories with uncommitted work'
+        ' to FILE, replacing it all at once, as --prompt does')
+    parser.add_option('--timings', '--profile', action='store_true',
+        help='print how long discovery, each version control system, and'
+        ' the slowest repositories took to standard error')
+    parser.add_option('--trace', metavar='FILE',
+        help='write every command and repository check to FILE as Chrome'
+        ' trace events (for chrome://tracing or Perfetto); implies'
+        ' --timings')
 
     (options, args) = parser.parse_args()
+    options.deadline = None
+    if options.deadline_seconds is not None:
+        options.deadline = time() + options.deadline_seconds
 
     if not args:
         parser.print_help()
         exit(2)
 
-    if options.use_locate and (options.use_walk or options.follow_symlinks):
-        sys.stderr.write(
-            'Error: you cannot use "-l" together with "-w" or "-L"\n')
+    if options.jobs < 1 or options.walk_threads < 1 or (
+            options.walk_processes < 1):
+        sys.stderr.write('Error: the number of jobs, of walk threads, and'
+                         ' of walk processes must be at least 1\n')
         exit(2)
 
-    if options.use_locate:
-        find_repos = find_repositories_with_locate
-    elif options.follow_symlinks:
-        find_repos = find_repositories_by_walking_and_following_symlinks
-    else:
-        find_repos = find_repositories_by_walking_without_following_symlinks
+    if any(seconds is not None and seconds <= 0 for seconds in (
+            options.timeout, options.repo_timeout, options.deadline_seconds)):
+        sys.stderr.write('Error: timeouts and deadlines must be more than'
+                         ' 0 seconds\n')
+        exit(2)
+
+    if options.use_locate and (options.use_walk or options.follow_symlinks
+                               or options.index):
+        sys.stderr.write('Error: you cannot use "-l" together with'
+                         ' "-w", "-L", or "--index"\n')
+        exit(2)
+
+    if options.asyncio and (options.stream or options.hg_server
+                            or sys.version_info < (3, 5)):
+        sys.stderr.write('Error: "--asyncio" needs Python 3.5 or later,'
+                         ' and cannot be used with "--stream" or'
+                         ' "--hg-server"\n')
+        exit(2)
+
+    if options.watch and not (options.state_file or options.socket):
+        sys.stderr.write('Error: "--watch" needs a "--state-file" or a'
+                         ' "--socket" to report to\n')
+        exit(2)
+
+    if (options.state_file or options.socket) and not options.watch:
+        sys.stderr.write('Error: "--state-file" and "--socket" can only be'
+                         ' used with "--watch"\n')
+        exit(2)
+
+    if options.quiet:
+        options.any = True
+
+    if options.watch and (options.stream or options.asyncio or options.any
+                          or not sys.platform.startswith('linux')):
+        sys.stderr.write('Error: "--watch" needs Linux, and cannot be used'
+                         ' with "--stream", "--asyncio", or "--any"\n')
+        exit(2)
+
+    if options.index and options.walk_processes > 1:
+        sys.stderr.write('Error: you cannot use "--index" together with'
+                         ' "--walk-processes"\n')
+        exit(2)
+
+    if options.prompt_ttl is not None:
+        sys.stderr.write('Error: "--prompt-ttl" needs "--prompt"\n')
+        exit(2)
+
+    if options.summary_file and (options.any or options.watch):
+        sys.stderr.write('Error: you cannot use "--summary-file" together'
+                         ' with "--any", "--quiet", or "--watch"\n')
+        exit(2)
+
+    if options.reindex and not options.index:
+        sys.stderr.write('Error: "--reindex" needs an "--index" file\n')
+        exit(2)
 
     if sys.version_info[0] >= 3:
         # Turn string arguments back into their original bytes.
         fix = os.fsencode
         args = [fix(s) for s in args]
         options.ignore_patterns = [fix(s) for s in options.ignore_patterns]
+        options.prune = [fix(s) for s in options.prune]
+        if options.index is not None:
+            options.index = fix(options.index)
+        if options.state_file is not None:
+            options.state_file = fix(options.state_file)
+        if options.socket is not None:
+            options.socket = fix(options.socket)
+        if options.summary_file is not None:
+            options.summary_file = fix(options.summary_file)
         if options.ignore_svn_states is not None:
             options.ignore_svn_states = [
                 fix(s) for s in options.ignore_svn_states
             ]
 
-    repos = set()
+    for path in options.ignore_files:
+        try:
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines()
+        except EnvironmentError as e:
+            sys.stderr.write('Error: cannot read %s: %s\n' % (path, e.strerror))
+            exit(2)
+        options.ignore_patterns += [line.strip() for line in lines
+                                    if line.strip()
+                                    and not line.startswith(b'#')]
+    options.ignore = None
+    if options.ignore_patterns:
+        import re
+        try:
+            options.ignore = compile_ignore_patterns(options.ignore_patterns)
+        except re.error as e:
+            sys.stderr.write('Error: bad -I regular expression: %s\n'
+                             % (e,))
+            exit(2)
+
+    timings = None
+    if options.timings or options.trace:
+        from uncommitted.timings import Timings
+        timings = Timings()
 
-    for path in args:
-        path = os.path.abspath(path)
-        if not os.path.isdir(path):
-            sys.stderr.write('Error: not a directory: %s\n' % (path,))
-            continue
-        repos.update(find_repos(path))
+    index = None
+    if options.index:
+        from uncommitted.cache import DirectoryIndex
+        index = DirectoryIndex(os.path.abspath(options.index),
+                               options.reindex)
+
+    if options.use_locate:
+        find_repos = find_repositories_with_locate
+    elif options.follow_symlinks:
+        find_repos = partial(
+            find_repositories_by_walking_and_following_symlinks,
+            threads=options.walk_threads, index=index, ignore=options.ignore)
+    else:
+        find_repos = partial(
+            find_repositories_by_walking_without_following_symlinks,
+            threads=options.walk_threads, index=index, ignore=options.ignore)
+
+    ordered = not (options.stream or options.any)
+    repos = find_all_repositories(args, find_repos, set(options.prune),
+                                  options.walk_processes, options.ignore,
+                                  unique=not ordered)
+    if timings is not None:
+        repos = timings.phase('discovery', repos)
+    if ordered:
+        repos = sorted_unique(repos)
+
+    hg_servers = None
+    if options.hg_server:
+        from uncommitted.hgserver import CommandServers
+        hg_servers = CommandServers()
+    found = False
+    try:
+        if options.watch:
+            from uncommitted.watch import watch
+            watch(repos, options)
+        else:
+            found = scan(repos, options)
+    finally:
+        if hg_servers is not None:
+            hg_servers.close()
+            hg_servers = None
+
+    if index is not None:
+        save(index, 'index', [os.path.abspath(path) for path in args])
+
+    if timings is not None:
+        sys.stderr.write(timings.summary())
+        if options.trace:
+            timings.write_trace(options.trace)
 
-    repos = sorted(repos)
-    scan(repos, options)
+    if options.any and found:
+        exit(1)
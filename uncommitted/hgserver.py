@@ -0,0 +1,149 @@
+"""Run Mercurial commands through long-lived command servers.
+
+Starting Python and loading Mercurial costs far more than checking the
+status of a typical repository.  ``hg serve --cmdserver pipe`` pays that
+cost once, then runs one command after another as they are written to
+its standard input, each in whatever repository its ``--cwd`` names.
+
+The protocol is described at https://www.mercurial-scm.org/wiki/CommandServer
+and consists of messages that start with a one-byte channel name and a
+four-byte big-endian length.
+"""
+
+import os
+import struct
+import subprocess
+from threading import Lock, Timer, local
+
+SERVE = ('hg', 'serve', '--cmdserver', 'pipe',
+         '--config', 'extensions.color=!')
+HEADER = struct.Struct('>cI')
+
+class ServerError(Exception):
+    """Signal that a command server cannot be used."""
+
+class CommandServer(object):
+    """A single ``hg serve --cmdserver pipe`` process."""
+
+    def __init__(self):
+        self.killed = False
+        self.process = subprocess.Popen(
+            SERVE, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            cwd=os.path.abspath(os.sep))
+        channel, hello = self.receive()
+        if channel != b'o' or b'runcommand' not in hello.split(b'\n')[0]:
+            self.close()
+            raise ServerError('server cannot run commands')
+
+    def receive(self):
+        """Read one message, returning its channel and data."""
+        channel, length = HEADER.unpack(self.read(HEADER.size))
+        if channel in b'IL':
+            return channel, length  # a request for input, without data
+        return channel, self.read(length)
+
+    def read(self, length):
+        data = b''
+        while len(data) < length:
+            chunk = self.process.stdout.read(length - len(data))
+            if not chunk:
+                raise ServerError('server exited')
+            data += chunk
+        return data
+
+    def runcommand(self, args):
+        """Run ``hg args``, returning its exit code and standard output."""
+        data = b'\0'.join(args)
+        self.process.stdin.write(b'runcommand\n' + struct.pack('>I', len(data))
+                                 + data)
+        self.process.stdin.flush()
+        output = []
+        while True:
+            channel, data = self.receive()
+            if channel == b'o':
+                output.append(data)
+            elif channel == b'e':
+                os.write(2, data)
+            elif channel in b'IL':
+                self.process.stdin.write(struct.pack('>I', 0))
+                self.process.stdin.flush()
+            elif channel == b'r':
+                exit_code, = struct.unpack('>i', data)
+                return exit_code, b''.join(output)
+            elif channel.isupper():
+                raise ServerError('server needs channel %r' % channel)
+
+    def kill(self):
+        """Kill the server, interrupting any command that it is running."""
+        self.killed = True
+        self.process.kill()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except EnvironmentError:
+            pass
+        self.process.wait()
+
+class CommandServers(object):
+    """A command server for each thread that runs Mercurial commands.
+
+    If a server cannot be started, or stops responding, `run()` returns
+    None for the rest of that thread's commands, so that the caller can
+    start a separate ``hg`` for each of them instead.  A server that is
+    killed because a command ran out of time is replaced by a new one.
+    """
+
+    def __init__(self):
+        self.local = local()
+        self.servers = []
+        self.lock = Lock()
+
+    def run(self, args, cwd, timeout=None):
+        """Run ``hg args`` in `cwd`, returning (exit code, output) or None.
+
+        If the command is still running after `timeout` seconds, its
+        server is killed and the exit code returned is None.
+        """
+        server = getattr(self.local, 'server', None)
+        if server is False:
+            return None
+        args = [arg if isinstance(arg, bytes) else arg.encode('utf-8')
+                for arg in args]
+        timer = None
+        try:
+            if server is None:
+                server = self.local.server = CommandServer()
+                with self.lock:
+                    self.servers.append(server)
+            if timeout is not None:
+                timer = Timer(timeout, server.kill)
+                timer.start()
+            result = server.runcommand([b'--cwd', cwd] + args)
+        except (ServerError, EnvironmentError, struct.error):
+            if server is not None and server.killed:
+                self.local.server = None
+                return None, b''
+            self.local.server = False
+            return None
+        finally:
+            if timer is not None:
+                timer.cancel()
+                timer.join()
+        if server.killed:  # just after the command finished
+            self.local.server = None
+        return result
+
+    def kill(self):
+        """Kill every server, interrupting the commands they are running."""
+        with self.lock:
+            servers = list(self.servers)
+        for server in servers:
+            server.kill()
+
+    def close(self):
+        """Stop every server."""
+        with self.lock:
+            servers, self.servers = self.servers, []
+        for server in servers:
+            server.close()
@@ -0,0 +1,63 @@
+"""A compact set of the (device, inode) pairs that identify directories."""
+
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+try:
+    array('Q')
+    TYPECODE = 'Q'
+except ValueError:  # Python 2
+    TYPECODE = 'L'
+
+# How many inodes of a device wait in an ordinary set before being packed.
+BUFFER = 4096
+
+class InodeSet(object):
+    """A set of (st_dev, st_ino) pairs, at about 8 bytes for each pair.
+
+    A Python set of tuples spends more than a hundred bytes on each one,
+    which adds up when walking millions of directories.  Here the inodes
+    of each device are instead packed into sorted arrays of unsigned
+    integers, called runs, that are merged like the digits of a binary
+    counter whenever a new run would be as long as the one before it.
+    So there are only ever about log2(n / BUFFER) runs to search, and
+    only the newest inodes are kept in an ordinary set.
+    """
+
+    def __init__(self):
+        self.devices = {}  # st_dev -> [set of new inodes, list of runs]
+
+    def __contains__(self, pair):
+        dev, ino = pair
+        device = self.devices.get(dev)
+        if device is None:
+            return False
+        pending, runs = device
+        if ino in pending:
+            return True
+        for run in runs:
+            i = bisect_left(run, ino)
+            if i < len(run) and run[i] == ino:
+                return True
+        return False
+
+    def add(self, pair):
+        if pair in self:
+            return
+        dev, ino = pair
+        device = self.devices.get(dev)
+        if device is None:
+            device = self.devices[dev] = [set(), []]
+        pending, runs = device
+        pending.add(ino)
+        if len(pending) >= BUFFER:
+            run = array(TYPECODE, sorted(pending))
+            pending.clear()
+            while runs and len(runs[-1]) <= len(run):
+                run = array(TYPECODE, merge(runs.pop(), run))
+            runs.append(run)
+
+    def update(self, pairs):
+        for pair in pairs:
+            self.add(pair)
@@ -0,0 +1,412 @@
+"""Decide whether a git repository is clean without running git.
+
+Most repositories in a scan are clean, and proving it takes several git
+processes.  `git_is_clean()` reaches the same verdict by reading the
+repository's files: the index must record exactly the tree of the HEAD
+commit, every file in the working tree must still have the stat()
+details that the index recorded for it, and every branch must point at
+the same commit as its upstream.
+
+Whenever the answer is anything less than certain, git is asked
+instead: when the index uses a split index, a sparse checkout, an
+fsmonitor, or an extension we do not know; when a file's details
+differ from the index at all, even if its contents might not; when a
+file was modified so recently that git would look at its contents;
+when there are submodules or unmerged entries; when a branch and its
+upstream point at different commits; and when a ref or object cannot be
+found where we look for it.
+"""
+
+import os
+import stat
+import struct
+import zlib
+from binascii import hexlify, unhexlify
+from mmap import ACCESS_READ, mmap
+
+from uncommitted.cache import git_directory
+
+ENTRY = struct.Struct('>10I20sH')
+EXTENSION = struct.Struct('>4sI')
+UNCERTAIN_EXTENSIONS = (b'link', b'FSMN', b'sdir')
+FALSE = (b'false', b'no', b'off', b'0')
+sep = os.sep.encode('ascii')
+
+class Uncertain(Exception):
+    """Signal that the repository might not be clean."""
+
+def git_is_clean(path, options):
+    """Return whether the git repository at `path` is provably clean.
+
+    A clean repository is one for which `status_git()` would return no
+    lines and no subrepos.  False means that we could not prove it, not
+    that the repository is dirty.
+    """
+    try:
+        check_clean(path, options)
+    except (Uncertain, EnvironmentError, IndexError, ValueError,
+            struct.error, zlib.error):
+        return False
+    return True
+
+def check_clean(path, options):
+    """Raise `Uncertain` unless the repository at `path` is clean."""
+    if options.untracked:
+        raise Uncertain('untracked files are not recorded in the index')
+    if os.path.exists(os.path.join(path, b'.gitmodules')):
+        raise Uncertain('submodules need to be checked by git')
+    gitdir = git_directory(os.path.join(path, b'.git'))
+    commondir = gitdir
+    commondir_path = os.path.join(gitdir, b'commondir')
+    if os.path.isfile(commondir_path):
+        with open(commondir_path, 'rb') as f:
+            commondir = os.path.join(gitdir, f.read().strip())
+
+    config = read_config(os.path.join(commondir, b'config'))
+    for key in ((b'core', None, b'sparsecheckout'),
+                (b'core', None, b'fsmonitor'),
+                (b'core', None, b'splitindex'),
+                (b'index', None, b'sparse'),
+                (b'extensions', None, b'worktreeconfig')):
+        if config.get(key, [b'false'])[-1].lower() not in FALSE:
+            raise Uncertain('the index might not describe every file')
+    object_format = config.get((b'extensions', None, b'objectformat'))
+    if object_format and object_format[-1].lower() != b'sha1':
+        raise Uncertain('only SHA-1 object names are understood')
+
+    refs = References(gitdir, commondir)
+    head = refs.resolve(b'HEAD')
+    if head is None:
+        raise Uncertain('there are no commits yet')
+    for name, commit in refs.branches().items():
+        upstream = upstream_of(config, name[len(b'refs/heads/'):])
+        if upstream is None:
+            if options.non_tracking:
+                raise Uncertain('non-tracking branches are reported')
+        elif refs.resolve(upstream) != commit:
+            raise Uncertain('a branch might be ahead of its upstream')
+
+    if options.stash and refs.resolve(b'refs/stash') is not None:
+        raise Uncertain('the stash is reported')
+
+    tree = commit_tree(os.path.join(commondir, b'objects'), head)
+    check_index(path, os.path.join(gitdir, b'index'), tree)
+
+def check_index(path, index_path, tree):
+    """Check the index against the working tree and the HEAD `tree`."""
+    if not hasattr(os.stat_result, 'st_mtime_ns'):
+        raise Uncertain('nanosecond file times are not available')
+    with open(index_path, 'rb') as f:
+        index_stat = os.fstat(f.fileno())
+        data = f.read()
+    racy = (int(index_stat.st_mtime), index_stat.st_mtime_ns % 1000000000)
+    count, = struct.unpack_from('>I', data, 8)
+    offset = 12
+    for fields, extended_flags, name, offset in index_entries(data):
+        (ctime, ctime_ns, mtime, mtime_ns, dev, ino, mode, uid, gid, size,
+         sha, flags) = fields
+        if flags & 0xb000:
+            raise Uncertain('entry is unmerged or assumed unchanged')
+        if extended_flags:
+            raise Uncertain('entry is skip-worktree or intent-to-add')
+        if mode >> 12 not in (0o10, 0o12):
+            raise Uncertain('entry is a submodule')
+        if (mtime, mtime_ns) >= racy:
+            raise Uncertain('entry is racily clean')
+        st = os.lstat(os.path.join(path, name.replace(b'/', sep)))
+        if (ctime, ctime_ns, mtime, mtime_ns, ino, size, mode) != (
+                int(st.st_ctime), st.st_ctime_ns % 1000000000,
+                int(st.st_mtime), st.st_mtime_ns % 1000000000,
+                st.st_ino & 0xffffffff, st.st_size & 0xffffffff,
+                git_mode(st.st_mode)):
+            raise Uncertain('entry might have been modified')
+
+    index_tree = None
+    end = len(data) - 20
+    while offset < end:
+        signature, size = EXTENSION.unpack_from(data, offset)
+        offset += EXTENSION.size
+        if signature in UNCERTAIN_EXTENSIONS or not b'A' <= signature[:1] \
+                <= b'Z':
+            raise Uncertain('index extension is not understood')
+        if signature == b'TREE':
+            index_tree = root_tree(data[offset:offset + size], count)
+        offset += size
+
+    if index_tree is None or index_tree != tree:
+        raise Uncertain('index might not match the HEAD commit')
+
+def index_entries(data):
+    """Yield (stat fields, extended flags, path, end) for each index entry.
+
+    The end is the offset just past the entry, where the extensions
+    begin once the last entry has been read.
+    """
+    signature, version, count = struct.unpack_from('>4sII', data)
+    if signature != b'DIRC' or version not in (2, 3, 4):
+        raise Uncertain('unknown index format')
+    offset = 12
+    name = b''
+    for i in range(count):
+        start = offset
+        fields = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        extended_flags = 0
+        if fields[-1] & 0x4000:
+            extended_flags, = struct.unpack_from('>H', data, offset)
+            offset += 2
+        if version == 4:
+            strip, offset = varint(data, offset)
+            end = data.index(b'\0', offset)
+            name = name[:len(name) - strip] + data[offset:end]
+            offset = end + 1
+        else:
+            end = data.index(b'\0', offset)
+            name = data[offset:end]
+            offset = start + ((end - start + 8) & ~7)
+        yield fields, extended_flags, name, offset
+
+def tracked_paths(index_path):
+    """Return the set of files in the index and the directories above them.
+
+    Returns None if the index cannot be read.
+    """
+    paths = set()
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        for fields, extended_flags, name, offset in index_entries(data):
+            while name and name not in paths:
+                paths.add(name)
+                name = name.rpartition(b'/')[0]
+    except (Uncertain, EnvironmentError, IndexError, ValueError,
+            struct.error):
+        return None
+    return paths
+
+def root_tree(extension, count):
+    """Return the tree that the cache-tree extension says the index has."""
+    newline = extension.index(b'\n')
+    if extension[:1] != b'\0':
+        raise Uncertain('cache-tree has no root')
+    entry_count, subtrees = extension[1:newline].split(b' ')
+    if int(entry_count) != count:
+        raise Uncertain('cache-tree root is out of date')
+    return hexlify(extension[newline + 1:newline + 21])
+
+def git_mode(mode):
+    """Return the mode that git would record for a file with `mode`."""
+    if stat.S_ISLNK(mode):
+        return 0o120000
+    if stat.S_ISREG(mode):
+        return 0o100755 if mode & 0o100 else 0o100644
+    raise Uncertain('entry is no longer a file')
+
+def varint(data, offset):
+    """Decode an index version 4 path prefix length."""
+    c = bytearray(data[offset:offset + 1])[0]
+    offset += 1
+    value = c & 127
+    while c & 128:
+        c = bytearray(data[offset:offset + 1])[0]
+        offset += 1
+        value = ((value + 1) << 7) | (c & 127)
+    return value, offset
+
+class References(object):
+    """Loose and packed refs of a repository."""
+
+    def __init__(self, gitdir, commondir):
+        self.gitdir = gitdir
+        self.commondir = commondir
+        self.packed = {}
+        try:
+            f = open(os.path.join(commondir, b'packed-refs'), 'rb')
+        except EnvironmentError:
+            return
+        with f:
+            for line in f:
+                if line[:1] not in (b'#', b'^'):
+                    sha, _, name = line.rstrip(b'\n').partition(b' ')
+                    self.packed[name] = sha
+
+    def resolve(self, name, depth=0):
+        """Return the commit that ref `name` points at, or None."""
+        if depth > 5:
+            raise Uncertain('symbolic refs nest too deeply')
+        base = self.gitdir if name == b'HEAD' else self.commondir
+        try:
+            with open(os.path.join(base, name), 'rb') as f:
+                value = f.read().strip()
+        except EnvironmentError:
+            value = self.packed.get(name)
+            if value is None:
+                return None
+        if value.startswith(b'ref: '):
+            return self.resolve(value[5:], depth + 1)
+        if len(value) != 40:
+            raise Uncertain('ref is not a SHA-1')
+        return value
+
+    def branches(self):
+        """Return a dictionary mapping each branch's ref to its commit."""
+        heads = b'refs/heads/'
+        branches = dict((name, sha) for name, sha in self.packed.items()
+                        if name.startswith(heads))
+        top = os.path.join(self.commondir, b'refs', b'heads')
+        for dirpath, dirnames, filenames in os.walk(top):
+            for filename in filenames:
+                if filename.endswith(b'.lock'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = heads + os.path.relpath(path, top).replace(sep, b'/')
+                with open(path, 'rb') as f:
+                    value = f.read().strip()
+                if len(value) != 40:
+                    raise Uncertain('branch is not a SHA-1')
+                branches[name] = value
+        return branches
+
+def upstream_of(config, branch):
+    """Return the ref of the remote-tracking branch for `branch`, or None."""
+    remote = config.get((b'branch', branch, b'remote'))
+    merge = config.get((b'branch', branch, b'merge'))
+    if remote is None or merge is None:
+        return None
+    remote = remote[-1]
+    merge = merge[-1]
+    if remote == b'.':
+        return merge
+    for refspec in config.get((b'remote', remote, b'fetch'), ()):
+        source, _, destination = refspec.lstrip(b'+').partition(b':')
+        if b'*' in source:
+            prefix, suffix = source.split(b'*', 1)
+            if merge.startswith(prefix) and merge.endswith(suffix) \
+                    and len(merge) >= len(prefix) + len(suffix):
+                middle = merge[len(prefix):len(merge) - len(suffix)]
+                return destination.replace(b'*', middle)
+        elif source == merge and destination:
+            return destination
+    return None
+
+def read_config(path):
+    """Parse a git config file into {(section, subsection, key): values}.
+
+    Section and key names are lowercased, like git does.  A key given
+    without a value is recorded as ``true``.
+    """
+    config = {}
+    section = subsection = None
+    with open(path, 'rb') as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        line = line.strip()
+        if not line or line[:1] in (b'#', b';'):
+            continue
+        if line.startswith(b'['):
+            header, _, rest = line[1:].partition(b']')
+            name, _, quoted = header.partition(b' ')
+            section = name.lower()
+            subsection = None
+            if quoted:
+                subsection = quoted.strip().strip(b'"').replace(
+                    b'\\"', b'"').replace(b'\\\\', b'\\')
+            elif b'.' in section:
+                section, subsection = section.split(b'.', 1)
+            if section in (b'include', b'includeif'):
+                raise Uncertain('config includes another file')
+            line = rest.strip()
+            if not line or line[:1] in (b'#', b';'):
+                continue
+        key, equals, value = line.partition(b'=')
+        if b'"' in value or b'\\' in value:
+            raise Uncertain('config value is quoted')
+        value = value.split(b'#')[0].split(b';')[0].strip()
+        config.setdefault((section, subsection, key.strip().lower()), []) \
+            .append(value if equals else b'true')
+    return config
+
+def commit_tree(objects, commit):
+    """Return the tree of `commit`, read from the object database."""
+    data = loose_object(objects, commit)
+    if data is None:
+        data = packed_object(objects, commit)
+    if data is None:
+        raise Uncertain('commit is not in this object database')
+    if not data.startswith(b'tree '):
+        raise Uncertain('object is not a commit')
+    return data[5:45]
+
+def loose_object(objects, sha):
+    """Return the start of a loose commit's contents, or None."""
+    try:
+        f = open(os.path.join(objects, sha[:2], sha[2:]), 'rb')
+    except EnvironmentError:
+        return None
+    with f:
+        data = zlib.decompressobj().decompress(f.read(), 4096)
+    header, _, data = data.partition(b'\0')
+    if not header.startswith(b'commit '):
+        raise Uncertain('object is not a commit')
+    return data
+
+def packed_object(objects, sha):
+    """Return the start of a packed commit's contents, or None."""
+    pack_directory = os.path.join(objects, b'pack')
+    try:
+        names = os.listdir(pack_directory)
+    except EnvironmentError:
+        return None
+    binsha = unhexlify(sha)
+    for name in names:
+        if name.endswith(b'.idx'):
+            path = os.path.join(pack_directory, name)
+            offset = pack_offset(path, binsha)
+            if offset is not None:
+                return pack_commit(path[:-4] + b'.pack', offset)
+    return None
+
+def pack_offset(path, binsha):
+    """Look up `binsha` in a version 2 pack index, returning its offset."""
+    with open(path, 'rb') as f:
+        data = mmap(f.fileno(), 0, access=ACCESS_READ)
+    try:
+        if data[:8] != b'\377tOc\0\0\0\2':
+            raise Uncertain('unknown pack index format')
+        fanout = struct.unpack_from('>256I', data, 8)
+        first = bytearray(binsha)[0]
+        low = fanout[first - 1] if first else 0
+        high = fanout[first]
+        count = fanout[255]
+        while low < high:
+            middle = (low + high) // 2
+            start = 1032 + middle * 20
+            candidate = data[start:start + 20]
+            if candidate < binsha:
+                low = middle + 1
+            elif candidate > binsha:
+                high = middle
+            else:
+                offset, = struct.unpack_from(
+                    '>I', data, 1032 + count * 24 + middle * 4)
+                if offset & 0x80000000:
+                    offset, = struct.unpack_from(
+                        '>Q', data, 1032 + count * 28
+                        + (offset & 0x7fffffff) * 8)
+                return offset
+        return None
+    finally:
+        data.close()
+
+def pack_commit(path, offset):
+    """Return the start of the commit at `offset` in a pack file."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(4096)
+    header = bytearray(data[:10])
+    if (header[0] >> 4) & 7 != 1:
+        raise Uncertain('packed object is not a whole commit')
+    i = 0
+    while header[i] & 0x80:
+        i += 1
+    return zlib.decompressobj().decompress(data[i + 1:], 4096)
@@ -0,0 +1,54 @@
+"""A compact record of which directory trees have already been covered."""
+
+import os
+
+sep = os.sep.encode('ascii')
+
+class PathTrie(object):
+    """Directories that are covered, together with holes inside them.
+
+    Each node is a two-item list of the mark for its directory (True
+    for covered, False for a hole, or None for neither) and a dictionary
+    of child nodes by name, or None if it has no children yet.  Parent
+    directories share their nodes, so that only the path components of
+    the marked directories are kept, and `covers()` takes time in
+    proportion to the depth of the path it is asked about.
+    """
+
+    def __init__(self):
+        self.root = [None, None]
+
+    def cover(self, path):
+        """Mark `path` and everything beneath it as covered."""
+        self.node(path)[0] = True
+
+    def exclude(self, path):
+        """Mark `path` and everything beneath it as not covered."""
+        self.node(path)[0] = False
+
+    def covers(self, path):
+        """Return whether the nearest marked directory above `path` is covered.
+
+        `path` itself counts as being above itself.
+        """
+        node = self.root
+        covered = False
+        for name in path.split(sep):
+            if node[0] is not None:
+                covered = node[0]
+            children = node[1]
+            if children is None or name not in children:
+                return covered
+            node = children[name]
+        return covered if node[0] is None else node[0]
+
+    def node(self, path):
+        node = self.root
+        for name in path.split(sep):
+            if node[1] is None:
+                node[1] = {}
+            child = node[1].get(name)
+            if child is None:
+                child = node[1][name] = [None, None]
+            node = child
+        return node
@@ -0,0 +1,124 @@
+"""Answer shell prompts from a summary written by an earlier scan.
+
+``uncommitted --prompt path...`` prints how many repositories had
+uncommitted work when last scanned with the same arguments from the same
+directory, which is all that a prompt has time for.  The count is read
+from a summary file that the scan wrote with ``--summary-file``, so no
+repository is looked at, and neither optparse nor anything else that
+the scan itself needs is imported.
+
+If the summary is missing, or older than ``--prompt-ttl`` seconds, a new
+scan is started in a detached background process to replace it.  Only
+one is started per TTL, however many prompts ask, because each start
+first has to claim a stamp file that is no older than that.
+"""
+
+import os
+import sys
+import zlib
+from time import time
+
+from uncommitted.command import (
+    NEW_SESSION, cache_directory, make_directories, output, sep,
+    )
+
+DEFAULT_TTL = 60.0
+
+def prompt(argv):
+    """Print the count for the command line `argv`, returning an exit code."""
+    try:
+        ttl, args = parse(argv)
+    except ValueError:
+        sys.stderr.write('Error: "--prompt-ttl" needs a number of seconds\n')
+        return 2
+    if sys.version_info[0] >= 3:
+        args = [os.fsencode(arg) for arg in args]
+        cwd = os.getcwdb()
+    else:  # Python 2
+        cwd = os.getcwd()
+    path = summary_path(cwd, args)
+    try:
+        with open(path, 'rb') as f:
+            count = f.read().strip()
+            age = time() - os.fstat(f.fileno()).st_mtime
+    except EnvironmentError:
+        count, age = None, None
+    if count:
+        output(count)
+    if age is None or age > ttl:
+        refresh(args, path, ttl)
+    return 0
+
+def parse(argv):
+    """Remove the --prompt options from `argv`, returning (TTL, the rest).
+
+    The rest are passed to the background scan, which checks them.
+    """
+    ttl = DEFAULT_TTL
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '--prompt':
+            continue
+        elif arg == '--prompt-ttl':
+            ttl = float(next(args, ''))
+        elif arg.startswith('--prompt-ttl='):
+            ttl = float(arg.split('=', 1)[1])
+        else:
+            rest.append(arg)
+    if not ttl > 0:
+        raise ValueError(ttl)
+    return ttl, rest
+
+def summary_path(cwd, args):
+    """Return the summary file for a scan of `args` run from `cwd`."""
+    key = zlib.crc32(b'\0'.join([cwd] + args)) & 0xffffffff
+    return cache_directory() + sep + b'prompt-%08x' % key
+
+def refresh(args, path, ttl):
+    """Start a scan that rewrites the summary at `path`, unless too soon."""
+    make_directories(os.path.dirname(path))
+    if not claim(path + b'.refresh', ttl):
+        return
+    import subprocess
+    # Make sure that the scan imports this same copy of uncommitted.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    command = ([sys.executable, '-m', 'uncommitted'] + args
+               + ['--summary-file', path])
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(command, stdin=devnull, stdout=devnull,
+                         stderr=devnull, close_fds=True, env=env,
+                         **NEW_SESSION)
+
+def claim(stamp, ttl):
+    """Return whether the `stamp` file lets us start a scan now.
+
+    A stamp that is older than `ttl` seconds is renamed out of the way
+    first, which only one of several processes racing for it can do.
+    """
+    try:
+        age = time() - os.stat(stamp).st_mtime
+    except OSError:
+        pass
+    else:
+        if age < ttl:
+            return False
+        stale = stamp + b'.%d' % os.getpid()
+        try:
+            os.rename(stamp, stale)
+            fresh = time() - os.stat(stale).st_mtime < ttl
+        except OSError:
+            return False
+        if fresh:  # another process replaced it before we could
+            os.rename(stale, stamp)
+            return False
+        os.unlink(stale)
+    try:
+        os.close(os.open(stamp, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o666))
+    except OSError:
+        return False
+    return True
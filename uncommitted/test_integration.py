@@ -1,5 +1,6 @@
 """Test whether `uncommitted` works."""
 
+import json
 import os
 import re
 import pytest
@@ -8,8 +9,11 @@ import stat
 import sys
 import tempfile
 import textwrap
+import time
+import uncommitted.cache
 import uncommitted.command
-from subprocess import check_call, call
+from optparse import Values
+from subprocess import check_call, check_output, call
 
 
 def correct_path_on_windows(path):
@@ -57,6 +61,12 @@ def tempdir():
     yield tempdir
     shutil.rmtree(tempdir, onerror=handle_remove_read_only)
 
+@pytest.fixture(autouse=True)
+def cache_home(tmpdir, monkeypatch):
+    """Give each test an empty cache, away from the user's own."""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    return str(tmpdir)
+
 @pytest.fixture(scope='module')
 def cc(tempdir):
     """Wrapper around `check_call` that sets $HOME to a temp directory."""
@@ -438,6 +448,29 @@ def test_follow_symlinks(checkouts):
 
     assert actual_output == expected_output
 
+def test_prune(checkouts):
+    """Do we skip directories named with --prune?"""
+    for flags in [], ['-L']:
+        actual_output = run('--prune', 'git-dirty', '--prune', 'hg-dirty',
+                            checkouts, *flags)
+
+        expected_output = dedent("""\
+            {path}/git-ignore - Git
+             M {filename}
+
+            {path}/hg-ignore - Mercurial
+             M {filename}
+
+            {path}/svn-dirty - Subversion
+             M       {filename}
+
+            {path}/svn-ignore - Subversion
+             M       {filename}
+
+            """, path=checkouts, filename=filename)
+
+        assert actual_output == expected_output
+
 def test_submodules(repo_with_submodules):
     """Do we inspect submodules?"""
     actual_output = run(repo_with_submodules, '-n')
@@ -461,6 +494,449 @@ def test_submodules(repo_with_submodules):
 
     assert actual_output == expected_output
 
+def test_batch_submodules(git_identity, tempdir, checkouts, cc):
+    """Are batched submodules reported the same, with fewer commands?"""
+    d = os.path.join(tempdir, 'batched')
+    remote = os.path.join(checkouts, 'git-clean')
+    cc(['git', 'init', d])
+    cc(['git', 'submodule', 'add', remote, 'outer'], cwd=d)
+    outer = os.path.join(d, 'outer')
+    cc(['git', 'checkout', '-b', 'non-tracking'], cwd=outer)
+    cc(['git', 'submodule', 'add', remote, 'inner'], cwd=outer)
+    cc(['git', 'commit', '-m', 'Add a nested submodule'], cwd=outer)
+    cc(['git', 'submodule', 'add', remote, 'plain'], cwd=d)
+    cc(['git', 'commit', '-a', '-m', 'Add submodules'], cwd=d)
+
+    def dirty(directory):
+        with open(os.path.join(directory, filename), 'ab') as f:
+            f.write(more_maxim)
+    inner = os.path.join(outer, 'inner')
+    dirty(inner)
+    cc(['git', 'stash'], cwd=inner)
+    dirty(inner)
+    dirty(os.path.join(d, 'plain'))
+
+    for flags in [], ['-v', '-u', '-n', '-s']:
+        args = ['--no-cache'] + flags + [d]
+        count, expected_output = count_commands(run, *args)
+        batched_count, actual_output = count_commands(
+            run, '--batch-submodules', *args)
+        assert actual_output == expected_output
+        assert batched_count < count
+
+def test_jobs(checkouts):
+    """Does checking repositories in parallel keep the output in order?"""
+    assert (run('--no-cache', '-j', '4', '-v', checkouts)
+            == run('--no-cache', '-v', checkouts))
+
+def test_jobs_submodules(repo_with_submodules):
+    """Are submodules still reported right after their parent with -j?"""
+    actual_output = run('--no-cache', '-j', '4', '-n', repo_with_submodules)
+    assert actual_output == run('--no-cache', '-n', repo_with_submodules)
+
+needs_asyncio = pytest.mark.skipif(sys.version_info < (3, 5),
+                                   reason='asyncio needs Python 3.5')
+
+@needs_asyncio
+def test_asyncio(checkouts, repo_with_submodules):
+    """Does the asyncio engine report the same as the others, in order?"""
+    assert (run('--no-cache', '--asyncio', '-j', '4', '-v', checkouts)
+            == run('--no-cache', '-v', checkouts))
+    actual_output = run('--no-cache', '--asyncio', '-j', '2', '-n',
+                        repo_with_submodules)
+    assert actual_output == run('--no-cache', '-n', repo_with_submodules)
+
+@needs_asyncio
+def test_asyncio_missing_command(checkouts):
+    """Does the asyncio engine say when a command cannot be found?"""
+    import asyncio
+    import uncommitted.aio
+    path = os.path.join(checkouts, 'git-clean')
+    path = path.encode(sys.getfilesystemencoding())
+    loop = asyncio.new_event_loop()
+    try:
+        semaphore = loop.run_until_complete(
+            uncommitted.aio.make_semaphore(1))
+        with pytest.raises(uncommitted.command.ErrorCommandMissing):
+            loop.run_until_complete(uncommitted.aio.run(
+                (b'git-asdf', b'status'), path, semaphore))
+        lines = loop.run_until_complete(uncommitted.aio.run(
+            (b'git', b'status', b'-s'), path, semaphore))
+    finally:
+        loop.close()
+    assert lines == []
+
+def test_hg_server(checkouts, monkeypatch):
+    """Do Mercurial command servers report the same as separate hg runs?"""
+    expected_output = run('--no-cache', '-v', checkouts)
+    assert run('--no-cache', '--hg-server', '-v', checkouts) == expected_output
+    assert run('--no-cache', '--hg-server', '-j', '4', '-v',
+               checkouts) == expected_output
+
+    # If no server can be started, hg should be run for each repository.
+    import uncommitted.hgserver
+    monkeypatch.setattr(uncommitted.hgserver, 'SERVE', ('hg-asdf', 'serve'))
+    assert run('--no-cache', '--hg-server', '-v', checkouts) == expected_output
+
+def run_any(*args):
+    """Runs uncommitted --any, returning its exit status and output lines."""
+    sys.argv[:] = ['uncommitted', '--any'] + list(args)
+    original = uncommitted.command.output
+    outputs = []
+    try:
+        uncommitted.command.output = outputs.append
+        uncommitted.command.main()
+        status = 0
+    except SystemExit as e:
+        status = e.code
+    finally:
+        uncommitted.command.output = original
+    return status, outputs
+
+def test_any(checkouts, clones, repo_with_submodules):
+    """Does --any agree with a full check about which repos have work?"""
+    paths = [os.path.join(d, name) for d in (checkouts, clones)
+             for name in sorted(os.listdir(d))] + [repo_with_submodules]
+    for flags in [], ['-u', '-n', '-s']:
+        for path in paths:
+            dirty = bool(run('--no-cache', *(flags + [path])))
+            status, outputs = run_any('--no-cache', *(flags + [path]))
+            assert (status, len(outputs)) == ((1, 1) if dirty else (0, 0))
+    assert run_any('-q', '-j', '4', checkouts) == (1, [])
+
+    # A submodule whose only change is an untracked file.
+    untracked = os.path.join(repo_with_submodules, 'git (open paren', 'new')
+    with open(untracked, 'wb') as f:
+        f.write(b'new')
+    try:
+        assert b' ? "git (open paren"' in run('--no-cache',
+                                              repo_with_submodules)
+        assert run_any('--no-cache', '-q', repo_with_submodules) == (1, [])
+    finally:
+        os.remove(untracked)
+
+def is_running(pid):
+    """Return whether process `pid` exists and is not a zombie."""
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'),
+                    reason='needs /proc to see which processes are left')
+def test_any_kills_running_checks(tmpdir, monkeypatch, cc):
+    """Once --any has its answer, are the commands still running killed?"""
+    pids = tmpdir.join('pids')
+    fake_hg = tmpdir.mkdir('bin').join('hg')
+    fake_hg.write('#!/bin/sh\necho $$ >> {0}\nsleep 60 &\necho $! >> {0}\n'
+                  'wait\n'.format(pids))
+    fake_hg.chmod(0o755)
+    monkeypatch.setenv('PATH', '%s%s%s' % (fake_hg.dirname, os.pathsep,
+                                           os.environ['PATH']))
+    repos = tmpdir.mkdir('repos')
+    hung = repos.mkdir('hung')
+    hung.mkdir('.hg')
+    dirty = repos.mkdir('dirty')
+    cc(['git', 'init'], cwd=str(dirty))
+    dirty.join('file').write('new')
+    cc(['git', 'add', 'file'], cwd=str(dirty))
+
+    start = time.time()
+    status, outputs = run_any('--no-cache', '-j', '4', str(hung), str(dirty))
+    assert time.time() - start < 10
+    assert (status, outputs) == (1, [str(dirty).encode('ascii') + b' - Git'])
+    for i in range(50):
+        if not any(is_running(int(pid)) for pid in pids.readlines()):
+            break
+        time.sleep(0.1)
+    assert not [pid for pid in pids.readlines() if is_running(int(pid))]
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs a shell script')
+def test_timeouts(tmpdir, monkeypatch):
+    """Are hung commands killed, and repos left at the deadline skipped?"""
+    # A git that hangs, and whose child keeps its output open even after
+    # it has been killed itself, unless the child is killed as well.
+    fake_git = tmpdir.mkdir('bin').join('git')
+    fake_git.write('#!/bin/sh\nsleep 60 &\nsleep 60\n')
+    fake_git.chmod(0o755)
+    monkeypatch.setenv('PATH', '%s%s%s' % (fake_git.dirname, os.pathsep,
+                                           os.environ['PATH']))
+    repos = tmpdir.mkdir('repos')
+    repos.mkdir('a').mkdir('.git')
+    repos.mkdir('b').mkdir('.git')
+    repos = str(repos)
+
+    start = time.time()
+    actual_output = run('--no-cache', '--timeout', '0.5', repos)
+    assert time.time() - start < 10
+    assert actual_output == dedent("""\
+        {path}/a - timed out: 'git' command killed
+
+        {path}/b - timed out: 'git' command killed
+
+        """, path=repos)
+
+    actual_output = run('--no-cache', '--deadline', '0.5', repos)
+    assert actual_output == dedent("""\
+        {path}/a - timed out: 'git' command killed
+
+        {path}/b - not checked: the deadline passed
+
+        """, path=repos)
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs a shell script')
+def test_svn_status_streamed(tmpdir, monkeypatch):
+    """Is svn status XML parsed as it streams in, and bad XML reported?"""
+    fake_svn = tmpdir.mkdir('bin').join('svn')
+    fake_svn.write(textwrap.dedent("""\
+        #!/bin/sh
+        case "$PWD" in
+        */good) printf '<?xml version="1.0"?><status><target path=".">'
+                i=0
+                while [ $i -lt 5000 ]; do
+                    printf '<entry path="f%d"><wc-status item="normal"' $i
+                    printf ' props="none"/></entry>'
+                    i=$((i + 1))
+                done
+                printf '<entry path="m"><wc-status item="modified"'
+                printf ' props="none"/></entry></target></status>' ;;
+        */bad) printf '<?xml version="1.0"?><status><target path=".">'
+               printf '<entry path="m"><wc-status item="modified"' ;;
+        */gone) echo 'svn: E155007: not a working copy' >&2; exit 1 ;;
+        esac
+        """))
+    fake_svn.chmod(0o755)
+    monkeypatch.setenv('PATH', '%s%s%s' % (fake_svn.dirname, os.pathsep,
+                                           os.environ['PATH']))
+    repos = tmpdir.mkdir('repos')
+    for name in 'good', 'bad', 'gone':
+        repos.mkdir(name).mkdir('.svn')
+    repos = str(repos)
+
+    expected_output = dedent("""\
+        {path}/bad - bad output: 'svn' command output not understood
+
+        {path}/good - Subversion
+         M       m
+
+        """, path=repos)
+    for flags in [], ['-j', '4'], ['--asyncio']:
+        assert run('--no-cache', *(flags + [repos])) == expected_output
+
+def git_options(**flags):
+    """Build the options that the git status functions look at."""
+    options = Values({'untracked': False, 'non_tracking': False,
+                      'stash': False, 'native': False, 'fsmonitor': False,
+                      'batch_submodules': False})
+    options._update_loose(flags)
+    return options
+
+def count_commands(function, *args):
+    """Call `function` and return how many commands it ran, plus its result."""
+    real_run = uncommitted.command.run
+    commands = []
+    def counting_run(command, *args, **kw):
+        commands.append(command)
+        return real_run(command, *args, **kw)
+    uncommitted.command.run = counting_run
+    try:
+        result = function(*args)
+    finally:
+        uncommitted.command.run = real_run
+    return len(commands), result
+
+def test_git_porcelain_matches_classic(checkouts, clones, repo_with_submodules,
+                                       cc):
+    """Does the porcelain v2 engine report what the classic engine does?"""
+    dirty_repo = os.path.join(checkouts, 'git-dirty')
+    paths = [dirty_repo, os.path.join(clones, 'git-complex'),
+             repo_with_submodules]
+    modified = os.path.join(repo_with_submodules, 'git (parens)', filename)
+    untracked = os.path.join(repo_with_submodules, 'git (open paren', 'new')
+    cc(['git', 'stash'], cwd=dirty_repo)
+    try:
+        for dirty_submodules in False, True:
+            if dirty_submodules:
+                with open(modified, 'ab') as f:
+                    f.write(b'more')
+                with open(untracked, 'wb') as f:
+                    f.write(b'new')
+            for options in git_options(), git_options(untracked=True,
+                                                      non_tracking=True,
+                                                      stash=True):
+                for path in paths:
+                    path = path.encode(sys.getfilesystemencoding())
+                    porcelain = uncommitted.command.status_git_porcelain(
+                        path, set(), options)
+                    classic = uncommitted.command.status_git_classic(
+                        path, set(), options)
+                    assert porcelain == classic
+        lines = uncommitted.command.status_git_porcelain(
+            repo_with_submodules.encode(sys.getfilesystemencoding()), set(),
+            git_options())[0]
+        assert lines == [b' ? "git (open paren"', b' m "git (parens)"']
+    finally:
+        cc(['git', 'stash', 'pop'], cwd=dirty_repo)
+        cc(['git', 'checkout', filename], cwd=os.path.dirname(modified))
+        if os.path.exists(untracked):
+            os.remove(untracked)
+
+def test_git_porcelain_runs_fewer_commands(clones):
+    """Does the porcelain v2 engine spawn fewer git processes?"""
+    path = os.path.join(clones, 'git-complex')
+    path = path.encode(sys.getfilesystemencoding())
+    options = git_options(non_tracking=True, stash=True)
+    classic_count, classic = count_commands(
+        uncommitted.command.status_git_classic, path, set(), options)
+    porcelain_count, porcelain = count_commands(
+        uncommitted.command.status_git_porcelain, path, set(), options)
+    assert porcelain == classic
+    assert (classic_count, porcelain_count) == (5, 2)
+
+def test_native(checkouts, clones):
+    """Are clean repositories recognized without running git?"""
+    status_git = uncommitted.command.status_git
+    def check(directory, **flags):
+        path = directory.encode(sys.getfilesystemencoding())
+        expected = status_git(path, set(), git_options(**flags))
+        count, actual = count_commands(
+            status_git, path, set(), git_options(native=True, **flags))
+        assert actual == expected
+        return count
+
+    assert check(os.path.join(clones, 'git-virgin')) == 0
+    assert check(os.path.join(checkouts, 'git-clean')) == 0
+    assert check(os.path.join(checkouts, 'git-clean'), non_tracking=True) > 0
+    assert check(os.path.join(checkouts, 'git-dirty')) > 0
+    assert check(os.path.join(clones, 'git-complex')) > 0
+
+def test_cache(tempdir, cc, cache_home, monkeypatch):
+    """Are unchanged repositories answered from the cache?"""
+    d = os.path.join(tempdir, 'cached')
+    os.mkdir(d)
+    cc(['git', 'init'], cwd=d)
+    file_to_edit = os.path.join(d, filename)
+    with open(file_to_edit, 'wb') as f:
+        f.write(maxim)
+    cc(['git', 'add', filename], cwd=d)
+    cc(['git', 'commit', '-m', 'Add a maxim'], cwd=d)
+
+    # Files modified in the last moment are not usually trusted to the
+    # cache, so turn that safety margin off.  Git, too, keeps rewriting
+    # its index while a file is as new as the index, so we backdate the
+    # file and let a first run refresh the index.
+    monkeypatch.setattr(uncommitted.cache, 'RACY_SECONDS', 0)
+    a_minute_ago = time.time() - 60
+    os.utime(file_to_edit, (a_minute_ago, a_minute_ago))
+    run(d)
+
+    assert count_commands(run, '-v', d)[0] == 2
+    assert count_commands(run, '-v', d) == (0, run('-v', '--no-cache', d))
+    assert os.listdir(os.path.join(cache_home, 'uncommitted'))
+
+    with open(file_to_edit, 'ab') as f:
+        f.write(more_maxim)
+    expected_output = dedent("""\
+        {path} - Git
+         M {filename}
+
+        """, path=d, filename=filename)
+    assert run(d) == expected_output
+
+def test_cache_unwritable(checkouts, cache_home, monkeypatch, capsys):
+    """Does a cache that cannot be written leave the scan unharmed?"""
+    not_a_directory = os.path.join(cache_home, 'file')
+    with open(not_a_directory, 'wb'):
+        pass
+    monkeypatch.setenv('XDG_CACHE_HOME', os.path.join(not_a_directory, 'x'))
+    index = os.path.join(not_a_directory, 'index')
+    d = os.path.join(checkouts, 'git-dirty')
+    expected_output = run('--no-cache', d)
+    capsys.readouterr()
+    assert run(d) == expected_output
+    assert run('--index', index, d) == expected_output
+    assert 'Warning: cannot write the cache' in capsys.readouterr().err
+
+def test_cache_skips_unchanging_directories(git_identity, tempdir, cc,
+                                            cache_home, monkeypatch):
+    """Are directories that cannot change the report left unwalked?"""
+    d = os.path.join(tempdir, 'cached-ignores')
+    os.mkdir(d)
+    cc(['git', 'init'], cwd=d)
+    for name in 'build', 'scratch', 'src':
+        os.mkdir(os.path.join(d, name))
+    with open(os.path.join(d, '.gitignore'), 'wb') as f:
+        f.write(b'build/\n')
+    with open(os.path.join(d, 'src', filename), 'wb') as f:
+        f.write(maxim)
+    cc(['git', 'add', '.gitignore', 'src'], cwd=d)
+    cc(['git', 'commit', '-m', 'Add a maxim'], cwd=d)
+
+    monkeypatch.setattr(uncommitted.cache, 'RACY_SECONDS', 0)
+    a_minute_ago = time.time() - 60
+    for name in '.gitignore', os.path.join('src', filename):
+        os.utime(os.path.join(d, name), (a_minute_ago, a_minute_ago))
+    run(d)
+    run(d)
+    run('-u', d)
+    assert count_commands(run, '-u', d)[0] == 0
+
+    # Without -u neither new file can matter; with -u the ignored one
+    # cannot, but the untracked one is reported.
+    for name in 'build', 'scratch':
+        with open(os.path.join(d, name, 'new'), 'wb') as f:
+            f.write(maxim)
+    assert count_commands(run, d) == (0, b'')
+    assert count_commands(run, '-u', d)[0] > 0
+
+    with open(os.path.join(d, 'src', filename), 'ab') as f:
+        f.write(more_maxim)
+    expected_output = dedent("""\
+        {path} - Git
+         M {filename}
+
+        """, path=d, filename='src/' + filename)
+    assert run(d) == expected_output
+
+def test_cache_skips_untracked_hg_directories(hg_identity, tempdir, cc,
+                                              cache_home, monkeypatch):
+    """Are Mercurial directories without tracked files left unwalked?"""
+    d = os.path.join(tempdir, 'cached-hg')
+    os.mkdir(d)
+    cc(['hg', 'init'], cwd=d)
+    for name in 'node_modules', 'src':
+        os.mkdir(os.path.join(d, name))
+    with open(os.path.join(d, 'src', filename), 'wb') as f:
+        f.write(maxim)
+    cc(['hg', 'add', os.path.join('src', filename)], cwd=d)
+    cc(['hg'] + hg_identity + ['commit', '-m', 'Add a maxim'], cwd=d)
+
+    monkeypatch.setattr(uncommitted.cache, 'RACY_SECONDS', 0)
+    a_minute_ago = time.time() - 60
+    os.utime(os.path.join(d, 'src', filename), (a_minute_ago, a_minute_ago))
+    run(d)
+    # Mercurial dates the dirstate it rewrites to the next whole second,
+    # which would look too new to trust, so that gets backdated as well.
+    dirstate = os.path.join(d, '.hg', 'dirstate')
+    os.utime(dirstate, (a_minute_ago, a_minute_ago))
+    run(d)
+    assert count_commands(run, d) == (0, b'')
+
+    # Untracked files are not reported for Mercurial, even with -u.
+    with open(os.path.join(d, 'node_modules', 'new'), 'wb') as f:
+        f.write(maxim)
+    assert count_commands(run, d) == (0, b'')
+
+    with open(os.path.join(d, 'src', filename), 'ab') as f:
+        f.write(more_maxim)
+    expected_output = dedent("""\
+        {path} - Mercurial
+         M {filename}
+
+        """, path=d, filename='src/' + filename)
+    assert run(d) == expected_output
+
 @pytest.fixture(scope='module')
 def svn_locked(tempdir, cc):
     """SVN repo containing a locked file.
@@ -532,18 +1008,260 @@ def test_symlink_loop(checkouts):
 
     assert actual_output == expected_output
 
+def test_ignore_glob_and_regex(checkouts, tmpdir):
+    """Do -I globs and regular expressions, and --ignore-file, work?"""
+    actual_output = run('-I', 'glob:git-*', '-I', 're:hg-(clean|dirty)$',
+                        '-v', checkouts)
+    for name in 'git-clean', 'git-dirty', 'git-ignore', 'hg-clean', 'hg-dirty':
+        line = 'Ignoring repo: %s/%s' % (checkouts, name)
+        assert line.encode('ascii') in actual_output
+    assert b'hg-ignore - Mercurial' in actual_output
+
+    ignore_file = tmpdir.join('ignore')
+    ignore_file.write('# Patterns\n\nglob:git-*\nre:hg-(clean|dirty)$\n')
+    assert run('--ignore-file', str(ignore_file), '-v',
+               checkouts) == actual_output
+
+def test_ignore_prunes_walk(tempdir, cc):
+    """Does the walk stop at a directory that -I ignores?"""
+    outer = os.path.join(tempdir, 'ignore-walk', 'outer')
+    inner = os.path.join(outer, 'inner')
+    os.makedirs(inner)
+    cc(['git', 'init'], cwd=outer)
+    cc(['git', 'init'], cwd=inner)
+    top = os.path.dirname(outer)
+    assert b'inner - Git' in run('-v', top)
+    actual_output = run('-v', '-I', 'glob:outer', top)
+    assert actual_output == ('Ignoring repo: %s\n\n' % outer).encode('ascii')
+
+def test_walk_threads(checkouts, repo_with_submodules):
+    """Does walking with several threads find the same repositories?"""
+    for flags in [], ['-L']:
+        args = ['--no-cache', '-v', checkouts, repo_with_submodules] + flags
+        assert run('--walk-threads', '4', *args) == run(*args)
+
+def test_walk_processes(checkouts, clones):
+    """Are paths searched in worker processes, each subtree only once?"""
+    paths = [checkouts, os.path.join(checkouts, 'git-dirty'), clones]
+    expected_output = run('--no-cache', '-v', checkouts, clones)
+    assert run('--no-cache', '-v', '--walk-processes', '3',
+               *paths) == expected_output
+
+def test_stream(checkouts, repo_with_submodules):
+    """Does --stream report every repository, subrepos after parents?"""
+    def blocks(output):
+        return sorted(output.split(b'\n\n'))
+    for flags in ['-v'], ['-v', '-j', '4'], ['-v', '--walk-threads', '4']:
+        args = ['--no-cache'] + flags + [checkouts]
+        assert blocks(run('--stream', *args)) == blocks(run(*args))
+    args = ['--no-cache', '-n', repo_with_submodules]
+    assert run('--stream', *args) == run(*args)
+
+def test_index(tempdir, cc, monkeypatch):
+    """Does --index avoid listing directories that have not changed?"""
+    root = os.path.join(tempdir, 'indexed')
+    index = os.path.join(tempdir, 'index.pickle')
+    os.makedirs(os.path.join(root, 'a', 'deeper'))
+    cc(['git', 'init'], cwd=os.path.join(root, 'a'))
+
+    # Directories changed in the last moment are usually listed again
+    # on the next run anyway, so turn that safety margin off.
+    monkeypatch.setattr(uncommitted.cache, 'RACY_SECONDS', 0)
+    real_list_subdirectories = uncommitted.command.list_subdirectories
+    listed = []
+    def counting_list_subdirectories(path):
+        listed.append(path)
+        return real_list_subdirectories(path)
+    monkeypatch.setattr(uncommitted.command, 'list_subdirectories',
+                        counting_list_subdirectories)
+
+    expected_output = run('-v', root)
+    del listed[:]
+    assert run('-v', '--index', index, root) == expected_output
+    assert len(listed) == 3
+    del listed[:]
+    assert run('-v', '--index', index, root) == expected_output
+    assert listed == []
+
+    cc(['git', 'init'], cwd=os.path.join(root, 'a', 'deeper'))
+    expected_output = run('-v', root)
+    del listed[:]
+    assert run('-v', '--index', index, root) == expected_output
+    assert len(listed) == 1
+    del listed[:]
+    assert run('-v', '--index', index, '--reindex', root) == expected_output
+    assert len(listed) == 3
+
+def test_json(checkouts, clones):
+    """Does --format json describe each repository?"""
+    records = json.loads(run('--format', 'json', '-n', checkouts, clones)
+                         .decode('ascii'))
+    records = dict((os.path.basename(r['path']), r) for r in records)
+    assert records['git-dirty']['vcs'] == 'Git'
+    assert records['git-dirty']['files'] == [{'status': ' M',
+                                              'path': filename}]
+    assert records['git-dirty']['non_tracking'] == ['master']
+    assert records['git-dirty']['stash'] is None
+    assert records['hg-dirty']['files'] == [{'status': 'M',
+                                             'path': filename}]
+    assert records['git-complex']['branches'] == [
+        {'name': 'behind-ahead', 'ahead': 1, 'behind': 1},
+        {'name': 'not-behind-ahead', 'ahead': 1, 'behind': 0},
+        ]
+    assert 'hg-clean' not in records
+
+def test_ndjson(checkouts):
+    """Does --format ndjson print one JSON object per line?"""
+    lines = run('--format', 'ndjson', '-v', checkouts).splitlines()
+    records = [json.loads(line.decode('ascii')) for line in lines]
+    paths = [os.path.basename(r['path']) for r in records]
+    assert paths == sorted(paths)
+    assert 'git-clean' in paths
+    assert all(r['duration'] >= 0 for r in records)
+
+needs_inotify = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                                   reason='inotify needs Linux')
+
+@needs_inotify
+def test_watch(git_identity, tempdir, cc, monkeypatch):
+    """Does --watch check a repository again after it changes?"""
+    import uncommitted.watch
+    monkeypatch.setenv('GIT_OPTIONAL_LOCKS', '0')
+    d = os.path.join(tempdir, 'watched')
+    cc(['git', 'init', d])
+    with open(os.path.join(d, filename), 'wb') as f:
+        f.write(maxim)
+    cc(['git', 'add', filename], cwd=d)
+    cc(['git', 'commit', '-m', 'Add a maxim'], cwd=d)
+    path = d.encode(sys.getfilesystemencoding())
+    options = Values({'verbose': False, 'untracked': False,
+                      'non_tracking': False, 'stash': False, 'ignore': None,
+                      'ignore_svn_states': None, 'native': False,
+                      'fsmonitor': False, 'any': False, 'prune': [],
+                      'jobs': 1, 'format': 'text', 'debounce': 0.1,
+                      'timeout': None, 'repo_timeout': None,
+                      'deadline': None, 'batch_submodules': False})
+    watcher = uncommitted.watch.Watcher([(path, b'.git')], options)
+    try:
+        watcher.start()
+        assert watcher.state() == b''
+        with open(os.path.join(d, filename), 'ab') as f:
+            f.write(more_maxim)
+        deadline = time.time() + 10
+        while not watcher.poll(0.5) and time.time() < deadline:
+            pass
+        assert watcher.state() == dedent("""\
+            {path}/watched - Git
+             M {filename}
+
+            """, path=tempdir, filename=filename)
+    finally:
+        watcher.close()
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs a detached scan')
+def test_prompt(checkouts, cache_home, tmpdir):
+    """Does --prompt answer from a summary that a background scan writes?"""
+    summary = str(tmpdir.join('summary'))
+    report = run('--summary-file', summary, checkouts)
+    with open(summary, 'rb') as f:
+        count = f.read()
+    assert int(count) == len([line for line in report.splitlines()
+                              if b' - ' in line and not line.startswith(b' ')])
+
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.dirname(os.path.abspath(uncommitted.command.__file__))))
+    command = [sys.executable, '-m', 'uncommitted', '--prompt',
+               '--prompt-ttl', '60', checkouts]
+    assert check_output(command, env=env) == b''  # starts the first scan
+    prompts = os.path.join(cache_home, 'uncommitted')
+    stamps = [name for name in os.listdir(prompts)
+              if name.endswith('.refresh')]
+    assert len(stamps) == 1
+    path = os.path.join(prompts, stamps[0][:-len('.refresh')])
+    for i in range(300):
+        if os.path.exists(path):
+            break
+        time.sleep(0.1)
+    assert check_output(command, env=env) == count
+
+    # A stale summary is refreshed, but only once per TTL.
+    stamp = path + '.refresh'
+    os.utime(path, (0, 0))
+    os.utime(stamp, (0, 0))
+    assert check_output(command, env=env) == count
+    claimed = os.path.getmtime(stamp)
+    assert claimed > 0
+    assert check_output(command, env=env) == count
+    assert os.path.getmtime(stamp) == claimed
+    for i in range(300):
+        if os.path.getmtime(path) > 0:
+            break
+        time.sleep(0.1)
+    assert os.path.getmtime(path) > 0
+
+def test_timings(checkouts, tmpdir, capsys):
+    """Does --trace record the commands and repositories it checked?"""
+    trace = str(tmpdir.join('trace.json'))
+    capsys.readouterr()
+    run('--no-cache', '--trace', trace, checkouts)
+    summary = capsys.readouterr().err
+    assert 'discovery' in summary
+    assert 'Slowest repositories:' in summary
+    assert '/git-dirty (Git)' in summary
+    with open(trace) as f:
+        events = json.load(f)['traceEvents']
+    commands = [e for e in events if e['cat'] == 'command']
+    repos = [e['name'] for e in events if e['cat'] == 'repository']
+    assert any(e['name'].startswith('git status') for e in commands)
+    assert all(e['dur'] >= 0 and 'exit_code' in e['args'] for e in commands)
+    assert os.path.join(checkouts, 'git-dirty') in repos
+
+def test_fsmonitor(checkouts, capsys):
+    """Does --fsmonitor report the same, and say which repos went fast?"""
+    expected_output = run('--no-cache', '-u', '-v', checkouts)
+    assert run('--no-cache', '--fsmonitor', '--timings', '-u', '-v',
+               checkouts) == expected_output
+    summary = capsys.readouterr().err
+    assert 'fast path' in summary
+    assert '/git-dirty (Git) [fast path: untracked cache' in summary
+
+def test_benchmark(tmpdir):
+    """Does the benchmark build a farm and time every strategy?"""
+    import uncommitted.benchmark
+    path = str(tmpdir.join('results.json'))
+    uncommitted.benchmark.main([
+        '--git', '2', '--hg', '0', '--plain', '2', '--submodules', '1',
+        '--repeat', '1', '-o', path,
+        ])
+    with open(path) as f:
+        results = json.load(f)['results']
+    names = [r['name'] for r in results]
+    assert 'discovery/walk' in names
+    assert 'status/cache-warm' in names
+    assert all(r['repositories'] == 2 for r in results)
+    serial = results[names.index('status/serial')]
+    warm = results[names.index('status/cache-warm')]
+    assert serial['commands'] > warm['commands']
+
 def test_missing_version_control_command(checkouts):
     """What if a version control binary is missing?"""
     real_run = uncommitted.command.run
+    real_stream = uncommitted.command.stream
     def fake_run(command, *args, **kw):
         command = list(command)
         command[0] += '-asdf'  # mess up binary name so it won't be found
         real_run(command, *args, **kw)
+    def fake_stream(command, *args, **kw):
+        command = list(command)
+        command[0] += '-asdf'
+        return real_stream(command, *args, **kw)
     uncommitted.command.run = fake_run
+    uncommitted.command.stream = fake_stream
     try:
         actual_output = run(checkouts)
     finally:
         uncommitted.command.run = real_run
+        uncommitted.command.stream = real_stream
 
     expected_output = dedent("""\
         {path}/git-clean - skipping: 'git-asdf' command not found
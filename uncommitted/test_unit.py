@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import sys
+from optparse import Values
 
 import pytest
 
 import uncommitted.command
+from uncommitted.pathtrie import PathTrie
 
 
 @pytest.mark.skipif(sys.platform == 'win32',
@@ -12,3 +14,200 @@ def test_run_can_handle_badly_encoded_output():
     some_bytes = b'tsch\xfc\xdf'  # 'tschüß' in latin1, outside UTF-8
     output = uncommitted.command.run([b'echo', some_bytes], cwd='.')
     assert output == [some_bytes]
+
+def test_describe_git_report():
+    options = Values({'verbose': False, 'non_tracking': True, 'stash': True})
+    lines = [b'R  "sp ace" -> "\\303\\274"',
+             b'?? new.txt',
+             b'* master 1234567 [ahead 2, behind 1] A [bracketed] subject',
+             b'[topic]',
+             b'stash@{0}: WIP on master: 1234567 Subject']
+    report = uncommitted.command.Report(b'/repo', b'Git', lines, None, 0.5)
+    record = uncommitted.command.describe(report, options)
+    assert record == {
+        'path': '/repo',
+        'vcs': 'Git',
+        'duration': 0.5,
+        'files': [
+            {'status': 'R ', 'path': u'\xfc', 'original_path': 'sp ace'},
+            {'status': '??', 'path': 'new.txt'},
+            ],
+        'branches': [{'name': 'master', 'ahead': 2, 'behind': 1}],
+        'non_tracking': ['topic'],
+        'stash': 1,
+        }
+
+SVN_STATUS_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<status>
+<target path=".">
+<entry path="modified.txt">
+<wc-status props="none" item="modified" revision="3">
+<commit revision="2"><author>me</author><date>2020-01-01</date></commit>
+</wc-status>
+</entry>
+<entry path="copied dir">
+<wc-status props="modified" item="added" copied="true" revision="-">
+</wc-status>
+</entry>
+<entry path="locked.txt">
+<wc-status props="none" item="normal" revision="3">
+<lock><token>opaquelocktoken:1</token><owner>me</owner></lock>
+</wc-status>
+</entry>
+<entry path="nested">
+<wc-status props="none" item="unversioned"></wc-status>
+</entry>
+<entry path="build">
+<wc-status props="none" item="ignored"></wc-status>
+</entry>
+<entry path="ext">
+<wc-status props="none" item="external"></wc-status>
+</entry>
+<entry path="build.log">
+<wc-status props="none" item="ignored"></wc-status>
+</entry>
+</target>
+</status>
+'''
+
+def test_subversion_status_xml(tmpdir):
+    for name in 'sub', 'nested', 'build', 'ext':
+        tmpdir.mkdir(name)
+    tmpdir.join('build.log').write('')
+    wc = str(tmpdir).encode('ascii')
+    options = Values({'ignore_svn_states': None})
+    ignore_set = PathTrie()
+    steps = uncommitted.command.subversion_steps(wc, ignore_set, options)
+    request = next(steps)
+    assert isinstance(request, uncommitted.command.Stream)
+    assert request.command == ['svn', 'status', '--xml', '--no-ignore']
+    chunks = [SVN_STATUS_XML[i:i + 7]
+              for i in range(0, len(SVN_STATUS_XML), 7)]
+    lines, subrepos = steps.send(iter(chunks))
+    assert lines == [
+        b' M       modified.txt',
+        b' AM +    copied dir',
+        b'      K  locked.txt',
+        ]
+    assert ignore_set.covers(wc + b'/sub/deeper')
+    assert not ignore_set.covers(wc + b'/nested')
+    assert not ignore_set.covers(wc + b'/build/sub')
+    assert not ignore_set.covers(wc + b'/ext')
+    assert not ignore_set.covers(b'/elsewhere')
+    # Ignored files cannot hold working copies, so they are not recorded.
+    assert b'build.log' not in ignore_set.node(wc)[1]
+
+def test_subversion_status_xml_truncated():
+    options = Values({'ignore_svn_states': None})
+    ignore_set = PathTrie()
+    steps = uncommitted.command.subversion_steps(b'/wc', ignore_set, options)
+    next(steps)
+    with pytest.raises(uncommitted.command.ErrorBadOutput):
+        steps.send([SVN_STATUS_XML[:len(SVN_STATUS_XML) // 2]])
+    assert not ignore_set.covers(b'/wc')
+
+def test_cache_format(tmpdir):
+    import pickle
+    import uncommitted.cache
+    path = str(tmpdir.join('scan.pickle')).encode('utf-8')
+    uncommitted.cache.dump({'key': 'entry'}, path)
+    assert uncommitted.cache.load(path) == {'key': 'entry'}
+
+    # A pickle from a release before formats were numbered is dropped.
+    with open(path, 'wb') as f:
+        pickle.dump({'key': 'entry'}, f, 2)
+    assert uncommitted.cache.load(path) == {}
+
+def test_make_directories(tmpdir):
+    path = str(tmpdir.join('a', 'b')).encode('utf-8')
+    uncommitted.command.make_directories(path)
+    uncommitted.command.make_directories(path)  # as if another process won
+    assert tmpdir.join('a', 'b').check(dir=True)
+    tmpdir.join('file').write('')
+    with pytest.raises(OSError):
+        uncommitted.command.make_directories(
+            str(tmpdir.join('file')).encode('utf-8'))
+
+def test_write_atomically(tmpdir):
+    path = str(tmpdir.join('state')).encode('utf-8')
+    uncommitted.command.write_atomically(path, b'first')
+    uncommitted.command.write_atomically(path, b'second')
+    with open(path, 'rb') as f:
+        assert f.read() == b'second'
+    assert tmpdir.listdir() == [tmpdir.join('state')]
+
+    # A failed replacement leaves no temporary file behind.
+    directory = str(tmpdir.mkdir('directory')).encode('utf-8')
+    with pytest.raises(EnvironmentError):
+        uncommitted.command.write_atomically(directory, b'third')
+    assert sorted(tmpdir.listdir()) == [tmpdir.join('directory'),
+                                        tmpdir.join('state')]
+
+def test_path_trie():
+    trie = PathTrie()
+    assert not trie.covers(b'/a')
+    trie.cover(b'/a')
+    trie.exclude(b'/a/b')
+    trie.cover(b'/a/b/c')
+    assert trie.covers(b'/a')
+    assert trie.covers(b'/a/x/y')
+    assert not trie.covers(b'/a/b')
+    assert not trie.covers(b'/a/b/x')
+    assert trie.covers(b'/a/b/c/d')
+    assert not trie.covers(b'/ab')
+    assert not trie.covers(b'/')
+
+def test_outermost_roots():
+    roots = uncommitted.command.outermost_roots
+    paths = [b'/b/x', b'/a', b'/b', b'/a/y/z', b'/ab', b'/a']
+    assert roots(paths, set()) == [b'/a', b'/b', b'/ab']
+    assert roots([b'/a/node_modules/x', b'/a'], {b'node_modules'}) == [
+        b'/a/node_modules/x', b'/a']
+    ignore = uncommitted.command.compile_ignore_patterns([b'glob:y'])
+    assert roots([b'/a', b'/a/y/z'], set(), ignore) == [b'/a', b'/a/y/z']
+
+def test_inode_set(monkeypatch):
+    import uncommitted.inodeset
+    monkeypatch.setattr(uncommitted.inodeset, 'BUFFER', 4)
+    inodes = uncommitted.inodeset.InodeSet()
+    pairs = [(dev, ino) for dev in (1, 2) for ino in range(0, 300, 3)]
+    inodes.update(pairs)
+    inodes.update(pairs[::7])
+    assert all(pair in inodes for pair in pairs)
+    assert not any((dev, ino) in inodes for dev in (1, 2, 3)
+                   for ino in range(1, 300, 3))
+    runs = inodes.devices[1][1]
+    assert sum(len(run) for run in runs) + len(inodes.devices[1][0]) == 100
+    assert len(runs) <= 5
+
+def test_sorted_unique():
+    sorted_unique = uncommitted.command.sorted_unique
+    assert sorted_unique([3, 1, 3, 2, 1]) == [1, 2, 3]
+    assert sorted_unique([]) == []
+
+# Measured at about 3 ms, against 25 ms before imports were deferred.
+IMPORT_BUDGET_MICROSECONDS = 15000
+DEFERRED_MODULES = ('optparse', 're', 'shlex', 'signal', 'subprocess',
+                    'threading')
+
+@pytest.mark.skipif(sys.version_info < (3, 8),
+                    reason="needs -X importtime and a pycache prefix")
+def test_import_time(tmpdir):
+    import os
+    import subprocess
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=str(tmpdir))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    command = [sys.executable, '-X', 'importtime', '-c',
+               'import uncommitted.command']
+    subprocess.check_call(command, env=env, stderr=subprocess.DEVNULL)
+    times = {}
+    for attempt in range(3):
+        stderr = subprocess.check_output(command, env=env,
+                                         stderr=subprocess.STDOUT)
+        for line in stderr.decode('ascii').splitlines()[1:]:
+            self_time, cumulative, name = line.split(':', 1)[1].split('|')
+            name = name.strip()
+            times[name] = min(times.get(name, int(cumulative)),
+                              int(cumulative))
+    assert not [name for name in DEFERRED_MODULES if name in times]
+    assert times['uncommitted.command'] < IMPORT_BUDGET_MICROSECONDS
@@ -0,0 +1,116 @@
+"""Record where the time goes during a run of "uncommitted"."""
+
+import json
+import os
+import sys
+from threading import Lock, current_thread
+from time import time
+
+SLOWEST = 10
+
+class Timings(object):
+    """Wall-clock timings of phases, commands, and repositories.
+
+    Each event is a tuple (category, name, start, duration, details),
+    where `start` is the time.time() at which it began and `details` is
+    a dictionary of anything else worth knowing about it.
+    """
+
+    def __init__(self):
+        self.start = time()
+        self.events = []
+        self.lock = Lock()
+
+    def record(self, category, name, start, duration, **details):
+        details['thread'] = current_thread().name
+        with self.lock:
+            self.events.append((category, name, start, duration, details))
+
+    def phase(self, name, iterable):
+        """Generate the items of `iterable`, timing how long that takes."""
+        start = time()
+        for item in iterable:
+            yield item
+        self.record('phase', name, start, time() - start)
+
+    def command(self, command, cwd, start, duration, exit_code):
+        self.record('command', b' '.join(bytes_of(c) for c in command),
+                    start, duration, cwd=cwd, exit_code=exit_code)
+
+    def repository(self, report, start, cached):
+        self.record('repository', report.directory, start, report.duration,
+                    vcs=report.vcsname, cached=cached)
+
+    def fast_path(self, directory, features):
+        self.record('fast path', directory, time(), 0.0,
+                    features=b', '.join(features))
+
+    def summary(self):
+        """Return a text summary of the timings."""
+        phases = [e for e in self.events if e[0] == 'phase']
+        commands = [e for e in self.events if e[0] == 'command']
+        repos = [e for e in self.events if e[0] == 'repository']
+        fast = dict((e[1], e[4]['features']) for e in self.events
+                    if e[0] == 'fast path')
+        lines = ['Timings:']
+        for category, name, start, duration, details in phases:
+            lines.append('  %-12s %9.3fs' % (name, duration))
+        lines.append('  %-12s %9.3fs  (%d repositories, %d cached,'
+                     ' %d commands)' % (
+            'total', time() - self.start, len(repos),
+            sum(1 for e in repos if e[4]['cached']), len(commands)))
+        by_vcs = {}
+        for category, name, start, duration, details in repos:
+            total, count = by_vcs.get(details['vcs'], (0.0, 0))
+            by_vcs[details['vcs']] = total + duration, count + 1
+        for vcs, (total, count) in sorted(by_vcs.items()):
+            lines.append('  %-12s %9.3fs  (%d repositories)' % (
+                text_of(vcs), total, count))
+        if fast:
+            lines.append('  %-12s %10s  (%d repositories)' % (
+                'fast path', '', sum(1 for e in repos if e[1] in fast)))
+        if repos:
+            lines.append('Slowest repositories:')
+            repos.sort(key=lambda e: e[3], reverse=True)
+            for category, name, start, duration, details in repos[:SLOWEST]:
+                line = '  %9.3fs  %s (%s)' % (
+                    duration, text_of(name), text_of(details['vcs']))
+                if name in fast:
+                    line += ' [fast path: %s]' % text_of(fast[name])
+                lines.append(line)
+        return '\n'.join(lines) + '\n'
+
+    def write_trace(self, path):
+        """Write the events in Chrome's trace event format.
+
+        The file can be loaded into chrome://tracing or Perfetto.
+        """
+        threads = {}
+        events = []
+        for category, name, start, duration, details in self.events:
+            tid = threads.setdefault(details['thread'], len(threads))
+            args = dict((key, text_of(value)) for key, value
+                        in details.items() if key != 'thread')
+            events.append({
+                'name': text_of(name),
+                'cat': category,
+                'ph': 'X',
+                'ts': int((start - self.start) * 1e6),
+                'dur': int(duration * 1e6),
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': args,
+                })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+def bytes_of(s):
+    return s if isinstance(s, bytes) else s.encode('utf-8')
+
+def text_of(value):
+    """Turn bytes into text, leaving other values alone."""
+    if not isinstance(value, bytes):
+        return value
+    if sys.version_info[0] >= 3:
+        return os.fsdecode(value)
+    return value.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
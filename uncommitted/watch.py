@@ -0,0 +1,361 @@
+"""Keep repository statuses up to date by watching them with inotify.
+
+After checking every repository once, `watch()` asks the Linux kernel to
+report changes to each directory of their working trees and metadata
+directories.  A repository is checked again only after one of its files
+has changed and things have then been quiet for a moment, so that a
+burst of changes, like a checkout or a build, costs a single check.
+
+The current report is written to a state file, by writing a temporary
+file and renaming it over the old one so that readers never see half of
+it, and is sent to every client that connects to a Unix socket.
+
+Repositories created after the watch starts are not noticed, except
+when they appear inside one that is already being watched.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+from time import time
+
+from uncommitted.command import (
+    DOTDIRS, check, describe, is_ignored, linesep, list_subdirectories,
+    report_lines, save, sep, write_atomically,
+    )
+from uncommitted.pathtrie import PathTrie
+
+# Flags from <sys/inotify.h>.
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+        | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT = struct.Struct('iIII')
+
+# Directories inside a metadata directory whose contents cannot change
+# a repository's status, and which can hold a great many subdirectories:
+# git's object store, Mercurial's per-file revlogs, and Subversion's
+# pristine copies.
+METADATA_SKIP = frozenset([b'objects', b'data', b'pristine'])
+
+# A repository that never stops changing is still checked this many
+# debounce periods after its first change.
+DEBOUNCE_LIMIT = 10
+
+class Inotify(object):
+    """A Linux inotify instance, reached through ctypes."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                   ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise_errno()
+
+    def fileno(self):
+        return self.fd
+
+    def add(self, path):
+        """Watch the directory `path`, returning its watch descriptor."""
+        wd = self.add_watch(self.fd, path, MASK)
+        if wd < 0:
+            raise_errno(path)
+        return wd
+
+    def read(self):
+        """Return a list of (watch descriptor, mask, name) events."""
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def raise_errno(path=None):
+    number = ctypes.get_errno()
+    if path is None:
+        raise OSError(number, os.strerror(number))
+    raise OSError(number, os.strerror(number), path)
+
+class Watcher(object):
+    """The latest reports for a set of repositories, and their watches.
+
+    Call `start()` to check every repository and begin watching, and
+    then `poll()` over and over to check the repositories that change.
+    """
+
+    def __init__(self, repos, options, cache=None):
+        self.repos = sorted(repos)
+        self.options = options
+        self.cache = cache
+        self.reports = {}   # (directory, dotdir) -> list of reports
+        self.paths = {}     # watch descriptor -> directory path
+        self.changed = {}   # (directory, dotdir) -> first, last change
+        self.inotify = Inotify()
+        self.warned = False
+
+    def start(self):
+        """Check every repository and start watching their directories."""
+        for directory, dotdir in self.repos:
+            self.add_tree(directory)
+        self.refresh(self.repos)
+
+    def state(self):
+        """Return the current report, rendered in the chosen format."""
+        reports = [report for repo in self.repos
+                   for report in self.reports.get(repo, ())]
+        return render(reports, self.options)
+
+    def poll(self, timeout):
+        """Wait up to `timeout` seconds for changes, and check repositories.
+
+        Returns whether any repository was checked.
+        """
+        readable, _, _ = select.select([self.inotify], [], [], timeout)
+        if readable:
+            self.handle(self.inotify.read(), time())
+        due = self.due(time())
+        if due:
+            self.refresh(due)
+        return bool(due)
+
+    def timeout(self, now):
+        """Return how long until a changed repository is due, or None."""
+        if not self.changed:
+            return None
+        return max(0.0, min(self.deadline(first, last) for first, last
+                            in self.changed.values()) - now)
+
+    def deadline(self, first, last):
+        debounce = self.options.debounce
+        return min(last + debounce, first + DEBOUNCE_LIMIT * debounce)
+
+    def due(self, now):
+        """Return the changed repositories that are ready to be checked."""
+        return [repo for repo in self.repos if repo in self.changed
+                and self.deadline(*self.changed[repo]) <= now]
+
+    def handle(self, events, now):
+        """Note which repositories the inotify `events` belong to."""
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                for repo in self.repos:
+                    self.touch(repo, now)
+                continue
+            path = self.paths.get(wd)
+            if path is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.paths[wd]
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(os.path.join(path, name))
+            if mask & IN_ISDIR and name in DOTDIRS:
+                self.add_repo((path, name))
+            for repo in self.owners(path):
+                self.touch(repo, now)
+
+    def touch(self, repo, now):
+        first, last = self.changed.get(repo, (now, now))
+        self.changed[repo] = first, now
+
+    def owners(self, path):
+        """Return the repositories that the directory `path` is part of."""
+        while True:
+            repos = [(path, dotdir) for dotdir in DOTDIRS
+                     if (path, dotdir) in self.reports]
+            if repos:
+                return repos
+            parent = os.path.dirname(path)
+            if parent == path:
+                return []
+            path = parent
+
+    def add_repo(self, repo):
+        if repo not in self.repos and not is_ignored(repo[0],
+                                                     self.options.ignore):
+            self.repos = sorted(self.repos + [repo])
+            self.reports[repo] = []
+
+    def add_tree(self, path):
+        """Watch `path` and the directories beneath it."""
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            try:
+                self.paths[self.inotify.add(path)] = path
+                subdirectories = list(list_subdirectories(path))
+            except OSError as e:
+                if e.errno == errno.ENOSPC and not self.warned:
+                    sys.stderr.write('Warning: out of inotify watches; raise'
+                                     ' fs.inotify.max_user_watches\n')
+                    self.warned = True
+                continue
+            in_metadata = bool(DOTDIRS.intersection(path.split(sep)))
+            for name, p, is_symlink in subdirectories:
+                if is_symlink or name in self.options.prune:
+                    continue
+                if in_metadata and name in METADATA_SKIP:
+                    continue
+                if is_ignored(p, self.options.ignore):
+                    continue
+                stack.append(p)
+
+    def refresh(self, repos):
+        """Check `repos` again and replace their reports."""
+        repos = set(repos)
+        if any(dotdir == b'.svn' for directory, dotdir in repos):
+            # Whether a Subversion directory is skipped depends on the
+            # working copies checked before it, so check them all again.
+            repos.update(repo for repo in self.repos if repo[1] == b'.svn')
+        gone = [repo for repo in repos
+                if not os.path.isdir(os.path.join(*repo))]
+        for repo in gone:
+            self.repos.remove(repo)
+            self.reports.pop(repo, None)
+            self.changed.pop(repo, None)
+        repos = [repo for repo in self.repos if repo in repos]
+        for repo in repos:
+            self.changed.pop(repo, None)
+        results = check_all(repos, PathTrie(), self.options, self.cache)
+        self.reports.update(zip(repos, results))
+        if self.cache is not None:
+            save(self.cache, 'cache')
+
+    def close(self):
+        self.inotify.close()
+
+def check_all(repos, ignore_set, options, cache=None):
+    """Check repositories, returning a list of reports for each.
+
+    Like `command.check_concurrently()`, up to ``options.jobs`` of them
+    are checked at once, except that Subversion working copies are
+    checked one at a time, in order.
+    """
+    if options.jobs == 1:
+        return [check(directory, dotdir, ignore_set, options, cache)
+                for directory, dotdir in repos]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(options.jobs)
+    try:
+        results = [None if dotdir == b'.svn' else
+                   pool.apply_async(check, (directory, dotdir, ignore_set,
+                                            options, cache))
+                   for directory, dotdir in repos]
+        return [check(directory, dotdir, ignore_set, options, cache)
+                if result is None else result.get()
+                for (directory, dotdir), result in zip(repos, results)]
+    finally:
+        pool.terminate()
+        pool.join()
+
+def render(reports, options):
+    """Render reports as bytes, the way `command.scan()` prints them."""
+    if options.format == 'text':
+        return b''.join(line + linesep for report in reports
+                        for line in report_lines(report, options))
+    records = (describe(report, options) for report in reports)
+    records = [record for record in records if record is not None]
+    if options.format == 'ndjson':
+        return b''.join(json.dumps(record, sort_keys=True).encode('ascii')
+                        + linesep for record in records)
+    return json.dumps(records, indent=2, sort_keys=True,
+                      separators=(',', ': ')).encode('ascii') + linesep
+
+def listen(path):
+    """Return a Unix socket listening at `path`, replacing a stale one."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(16)
+    return listener
+
+def serve(listener, data):
+    """Send `data` to one client of the `listener`, then hang up."""
+    try:
+        connection, _ = listener.accept()
+    except socket.error:
+        return
+    try:
+        connection.settimeout(1.0)
+        connection.sendall(data)
+    except socket.error:
+        pass
+    finally:
+        connection.close()
+
+def watch(repos, options):
+    """Check `repos`, then keep checking whichever ones change, forever.
+
+    Stops on SIGINT or SIGTERM.
+    """
+    cache = None
+    if options.use_cache:
+        from uncommitted.cache import ScanCache, default_path
+        cache = ScanCache(default_path())
+    # Stop git from refreshing the index during `git status`, so that our
+    # own checks do not look like changes to the repository.
+    os.environ['GIT_OPTIONAL_LOCKS'] = '0'
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    watcher = Watcher(repos, options, cache)
+    listener = None
+    try:
+        watcher.start()
+        state = watcher.state()
+        if options.state_file:
+            write_atomically(options.state_file, state)
+        if options.socket:
+            listener = listen(options.socket)
+        readers = [r for r in (watcher.inotify, listener) if r is not None]
+        while True:
+            readable, _, _ = select.select(readers, [], [],
+                                           watcher.timeout(time()))
+            if listener in readable:
+                serve(listener, state)
+            if watcher.inotify in readable:
+                watcher.handle(watcher.inotify.read(), time())
+            due = watcher.due(time())
+            if due:
+                watcher.refresh(due)
+                state = watcher.state()
+                if options.state_file:
+                    write_atomically(options.state_file, state)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if listener is not None:
+            listener.close()
+            os.unlink(options.socket)